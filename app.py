@@ -12,45 +12,251 @@ Features:
 Usage:
     python app.py
     Open browser to http://localhost:5000
+
+openpyxl, the voucher ledger and the output folders are only loaded on first
+use so the index page is served straight after boot. Set RECEIPTS_WARMUP=1 to
+load them in a background thread at start-up, or call /warmup.
 """
 
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for, session
-import openpyxl
-from openpyxl.styles import Font, Alignment, Border, Side
+import time
+_boot_started = time.perf_counter()
+
+from flask import (Flask, render_template, request, send_file, flash, redirect, url_for, session, jsonify,
+                   Response, stream_with_context)
 from datetime import datetime
 import re
 import os
 from werkzeug.utils import secure_filename
+import logging
 import io
 import tempfile
-import uuid
 import random
+import hashlib
+import hmac
+import json
+import mimetypes
+import threading
+from collections import Counter
+import receipt_metrics
+import receipt_profiling
+import static_assets
+from receipt_pdf import write_receipts_pdf
+from office_profiles import OfficeBusy, load_offices
+from receipt_template import font_row_height, load_template, load_template_file
+from receipt_reports import ReceiptAggregates, aggregate_receipts
+from ty_sheets import (PERIOD_PATTERN, REASON_LABELS, REASON_PHRASES_OH_CABLE, REASON_PHRASES_PITS,
+                       fault_reason, parse_ty_row, read_ty_data)
+from receipt_bundle import JOB_FILE_SUFFIXES, job_files, stream_zip
+from output_files import STALE_JOB_SECONDS, evict_old_outputs, open_output, reserve_job
+from voucher_ledger import JobAlreadyIssued, VoucherLedger
+from receipt_metrics import NULL_TIMER
+
+# Start-up timing report (milliseconds per phase), see /warmup
+startup_timings = {'imports': round((time.perf_counter() - _boot_started) * 1000, 2)}
+startup_logger = logging.getLogger('receipts.startup')
 
 app = Flask(__name__)
-app.secret_key = 'bsnl_cash_receipts_secret_key_2026'
+app.secret_key = os.environ.get('RECEIPTS_SECRET_KEY', 'bsnl_cash_receipts_secret_key_2026')
+static_assets.register(app)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'output'
+# Voucher ledger database, set RECEIPTS_LEDGER=off to number each upload from 1
+app.config['LEDGER_PATH'] = os.environ.get('RECEIPTS_LEDGER', os.path.join('data', 'voucher_ledger.db'))
+# Generated files older than this are removed (0 keeps them), see output_files.py
+app.config['OUTPUT_RETENTION_HOURS'] = float(os.environ.get('RECEIPTS_OUTPUT_RETENTION_HOURS', 0))
+# Token for admin endpoints (period bundles, ledger search), sent as X-Receipts-Admin
+app.config['ADMIN_TOKEN'] = os.environ.get('RECEIPTS_ADMIN_TOKEN', '')
+# Office profiles (contractors, budget heads, limits), see offices.example.json
+app.config['OFFICES_PATH'] = os.environ.get('RECEIPTS_OFFICES', 'offices.json')
+# Job slot lock files, shared by all worker processes of this host
+app.config['LOCK_FOLDER'] = os.environ.get('RECEIPTS_LOCK_FOLDER', os.path.join('data', 'locks'))
 ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
+OUTPUT_FORMATS = {'xlsx', 'pdf', 'both'}
+SHARD_MODES = {'month', 'date', 'contractor'}
+REPORT_MODES = {'sheet', 'csv', 'both'}
+
+# Template events per chunk of a streamed page (a few voucher cards)
+STREAM_BUFFER_SIZE = 64
+
+# Header carrying the admin token
+ADMIN_HEADER = 'X-Receipts-Admin'
+
+# Seconds between clean-ups of the output folder in one worker
+EVICTION_INTERVAL = 600
+
+# Validation limits for TY Adv Appl amounts
+MAX_PLAUSIBLE_AMOUNT = 50000
+AMOUNT_OUTLIER_FACTOR = 5  # flag amounts this many times the upload's average
+
+# Voucher geometry in points (Excel's default row height is 15pt)
+DEFAULT_ROW_HEIGHT = 15
+TITLE_ROW_HEIGHT = font_row_height(14)  # "CASH RECEIPT" is bold 14pt
+DESCRIPTION_ROW_HEIGHT = 75
+VOUCHER_ROWS = 12
+VOUCHER_SPACING_ROWS = 2
+VOUCHER_HEIGHT = TITLE_ROW_HEIGHT + (VOUCHER_ROWS - 2) * DEFAULT_ROW_HEIGHT + DESCRIPTION_ROW_HEIGHT
+VOUCHER_SPACING = VOUCHER_SPACING_ROWS * DEFAULT_ROW_HEIGHT
+
+# Printed page: A4 portrait with half-inch margins
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+PAGE_MARGIN = 0.5  # inches
+HEADER_MARGIN = 0.3  # inches
+RECEIPT_COLUMN_WIDTHS = {'A': 15, 'B': 12, 'C': 12, 'D': 12, 'E': 12, 'F': 12, 'G': 12, 'H': 12}
+
+MIMETYPES = {
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.pdf': 'application/pdf',
+    '.csv': 'text/csv',
+    '.zip': 'application/zip',
+}
+
+# Structured job log lines go to stderr when metrics are on
+if receipt_metrics.ENABLED:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+
+# Offices sharing this deployment; each gets its own contractors, output folder,
+# ledger, API result cache and job limit. The 'default' office is always there.
+OFFICES = load_offices(app.config['OFFICES_PATH'], app.config['LOCK_FOLDER'])
+DEFAULT_OFFICE = OFFICES['default']
+
+LEDGER_ENABLED = app.config['LEDGER_PATH'].lower() not in ('', 'off', 'none', '0')
+
+# Created on first use (see ensure_folders / get_voucher_ledger)
+folders_ready = False
+voucher_ledgers = {}
+lazy_init_lock = threading.Lock()
+last_eviction = 0
+
+def ensure_folders():
+    """Create upload/output directories if they don't exist (once per process)"""
+    global folders_ready
+    if not folders_ready:
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+        folders_ready = True
+
+def office_output_folder(office):
+    """Output folder of an office, created on first use"""
+    ensure_folders()
+    folder = office.output_folder(app.config['OUTPUT_FOLDER'])
+    if not office.is_default:
+        os.makedirs(folder, exist_ok=True)
+    return folder
+
+def evict_outputs():
+    """Remove expired outputs and dead jobs' work folders, at most every EVICTION_INTERVAL"""
+    global last_eviction
+    now = time.time()
+    with lazy_init_lock:
+        if now - last_eviction < EVICTION_INTERVAL:
+            return []
+        last_eviction = now
+    retention = app.config['OUTPUT_RETENTION_HOURS']
+    removed = evict_old_outputs(app.config['OUTPUT_FOLDER'], retention * 3600 if retention > 0 else None)
+    # Vouchers of jobs whose worker died along with their work folder
+    for office in OFFICES.values():
+        ledger = get_voucher_ledger(office)
+        if ledger is not None:
+            ledger.void_stale(STALE_JOB_SECONDS)
+    return removed
+
+def publish_job(outputs, ledger=None):
+    """Make a job's files downloadable, then count its vouchers as issued"""
+    outputs.publish_all()
+    if ledger is not None:
+        ledger.commit_job(outputs.name)
 
-# Contractor pools for PITS and OH Cable work
-CONTRACTORS_PITS = [
-    "Tilak G, 7th Cross, Veerasagara, Tumkur",
-    "K G Ravi Kaidala Tumkur",
-    "Narasimha Murthy, Kittadakuppe, Gubbi",
-    "Siddappa, Kaidala, Gulur Hobli, Tumkur"
-]
-
-CONTRACTORS_OH_CABLE = [
-    "Tilak G, 7th Cross, Veerasagara, Tumkur",
-    "K G Ravi Kaidala Tumkur",
-    "Narasimha Murthy, Kittadakuppe, Gubbi",
-    "Siddappa, Kaidala, Gulur Hobli, Tumkur"
-]
-
-# Create directories if they don't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+def discard_job(outputs, ledger=None):
+    """Remove what a job did not publish and give back vouchers it never issued"""
+    outputs.discard()
+    if ledger is not None:
+        ledger.void_job(outputs.name)
+
+def get_voucher_ledger(office=DEFAULT_OFFICE):
+    """Open an office's voucher ledger on first use, or None when it is switched off"""
+    if not LEDGER_ENABLED:
+        return None
+    ledger = voucher_ledgers.get(office.key)
+    if ledger is None:
+        with lazy_init_lock:
+            ledger = voucher_ledgers.get(office.key)
+            if ledger is None:
+                ledger = voucher_ledgers[office.key] = VoucherLedger(office.ledger_path(app.config['LEDGER_PATH']))
+    return ledger
+
+def get_office_template(office):
+    """Parsed voucher template of an office (re-read only when the file changes)"""
+    return load_template_file(office.template)
+
+def admin_authorized(office):
+    """Check the admin token header against the deployment's token or the office's own.
+
+    With no token configured the admin endpoints stay closed.
+    """
+    sent = request.headers.get(ADMIN_HEADER, '').encode()
+    tokens = [token for token in (app.config['ADMIN_TOKEN'], office.admin_token) if token]
+    return bool(sent) and any(hmac.compare_digest(sent, token.encode()) for token in tokens)
+
+def get_office(key):
+    """Office profile for a key, the default office when no key is given, None if unknown"""
+    if not key:
+        return DEFAULT_OFFICE
+    return OFFICES.get(key)
+
+def timed_step(name, func):
+    start = time.perf_counter()
+    result = func()
+    startup_timings[name] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+# The warm-up runs once; later calls get its report
+_warmup_lock = threading.Lock()
+
+def warm_up():
+    """Load everything /generate needs so the first upload is not slowed down.
+
+    Safe to call more than once; returns the start-up timing report of the
+    first warm-up ('warmup' is its own duration, 'ready' the time from boot
+    to its end).
+    """
+    with _warmup_lock:
+        if 'ready' not in startup_timings:
+            warm_up_once()
+    return dict(startup_timings)
+
+def warm_up_once():
+    started = time.perf_counter()
+    
+    # Heavy imports: openpyxl and the modules the writers use
+    timed_step('openpyxl', lambda: (
+        __import__('openpyxl'),
+        __import__('openpyxl.styles'),
+        __import__('openpyxl.worksheet.hyperlink'),
+        __import__('openpyxl.worksheet.pagebreak'),
+    ))
+    timed_step('folders', ensure_folders)
+    timed_step('ledger', get_voucher_ledger)
+    
+    # Fill the re module cache with the description patterns
+    sample = datetime(2025, 1, 1)
+    timed_step('regex', lambda: (
+        generate_description_pits(sample, "2 pits at 1.000km from Exchange due to road work", "Route", 1, "X"),
+        generate_description_oh_cable(sample, "100mtr at 1.000km from Exchange, bescom", "Route", 1, "X"),
+        PERIOD_PATTERN.search(""),
+    ))
+    
+    # Fingerprint static files and build their .gz/.br copies
+    timed_step('assets', static_assets.build_all)
+    
+    # Compile the Jinja templates
+    timed_step('templates', lambda: [app.jinja_env.get_template(name)
+                                     for name in ('index.html', 'preview.html', 'success.html')])
+    
+    startup_timings['warmup'] = round((time.perf_counter() - started) * 1000, 2)
+    startup_timings['ready'] = round((time.perf_counter() - _boot_started) * 1000, 2)
+    startup_logger.info('Start-up timings (ms): %s', json.dumps(startup_timings))
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -141,17 +347,7 @@ def generate_description_pits(date_obj, work_details, route, amount, contractor_
     
     route_desc = route if route else "OFC route"
     
-    reason = ""
-    if "water" in work_details.lower() or "pipeline" in work_details.lower():
-        reason = "due to JJM water pipeline trenching work"
-    elif "road" in work_details.lower() or "nh" in work_details.lower():
-        reason = "due to road work"
-    elif "bescom" in work_details.lower():
-        reason = "due to BESCOM work"
-    elif "rly" in work_details.lower() or "railway" in work_details.lower():
-        reason = "due to Railway work"
-    else:
-        reason = "for fault restoration"
+    reason = REASON_PHRASES_PITS[fault_reason(work_details, is_pits=True)]
     
     date_str = date_obj.strftime("%d-%m-%Y")
     
@@ -195,17 +391,7 @@ def generate_description_oh_cable(date_obj, work_details, route, amount, contrac
     
     route_desc = route if route else "OFC route"
     
-    reason = ""
-    if "bescom" in work_details.lower():
-        reason = "due to BESCOM work"
-    elif "road" in work_details.lower():
-        reason = "due to road work"
-    elif "monkey" in work_details.lower():
-        reason = "due to Monkey bite"
-    elif "water" in work_details.lower() or "pipeline" in work_details.lower():
-        reason = "due to water pipeline work"
-    else:
-        reason = "for fault restoration"
+    reason = REASON_PHRASES_OH_CABLE[fault_reason(work_details, is_pits=False)]
     
     date_str = date_obj.strftime("%d-%m-%Y")
     
@@ -217,76 +403,88 @@ def generate_description_oh_cable(date_obj, work_details, route, amount, contrac
     
     return description
 
-def generate_receipts(input_file):
-    """Generate cash receipts from uploaded Excel file"""
-    # Load workbook
-    wb_source = openpyxl.load_workbook(input_file)
-    
-    # Try to find TY Adv Appl sheet or similar
-    sheet_name = None
-    for name in wb_source.sheetnames:
-        if 'ty' in name.lower() and 'adv' in name.lower():
-            sheet_name = name
-            break
+def normalize_work_details(work_details):
+    """Lower-case work details without list numbering or punctuation,
+    so "2.Attended X cut." and "Attended X cut" compare equal.
+    A leading distance such as "1.088km" is kept: it is not numbering."""
+    text = re.sub(r'^\s*\d+\s*[.)](?!\d)\s*', '', str(work_details).lower())
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+def ty_fingerprint(entry):
+    """Key for spotting the same fault entry twice: date, route, amount and work details"""
+    key = '|'.join([
+        entry['date'].strftime('%Y-%m-%d'),
+        ' '.join(str(entry['route']).lower().split()),
+        str(entry['amount']),
+        normalize_work_details(entry['work_details']),
+    ])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def validate_ty_data(ty_data, period=None, check_issued=None):
+    """Flag duplicate entries, implausible amounts and out-of-period dates.
+
+    Runs in O(n): duplicates are found with a dict keyed on the entry
+    fingerprint. check_issued, if given, maps a list of fingerprints to
+    {fingerprint: description} for entries already issued in earlier jobs.
+    Each flagged entry gets a 'warnings' list; returns the number of warnings.
+    """
+    if not ty_data:
+        return 0
     
-    if not sheet_name:
-        sheet_name = wb_source.sheetnames[0]  # Use first sheet
+    # Without a period in the heading, use the month most entries fall in
+    if period is None:
+        month_counts = Counter((entry['date'].year, entry['date'].month) for entry in ty_data)
+        year, month = month_counts.most_common(1)[0][0]
+        period_label = datetime(year, month, 1).strftime('%b-%Y')
+        in_period = lambda d: (d.year, d.month) == (year, month)
+    else:
+        start, end = period
+        period_label = f"{start.strftime('%d-%m-%Y')} to {end.strftime('%d-%m-%Y')}"
+        in_period = lambda d: start.date() <= d.date() <= end.date()
     
-    ws_ty = wb_source[sheet_name]
+    average = sum(entry['amount'] for entry in ty_data) / len(ty_data)
     
-    # Read data
-    ty_data = []
-    for row_num in range(4, 100):  # Check up to row 100
-        date_val = ws_ty.cell(row_num, 1).value
-        route = ws_ty.cell(row_num, 2).value
-        work_details = ws_ty.cell(row_num, 3).value
-        pits_oh = ws_ty.cell(row_num, 7).value
-        amount = ws_ty.cell(row_num, 8).value
-        
-        if not date_val or not amount or work_details in ["Local Purchase", "Total", None]:
-            continue
+    seen = {}
+    for index, entry in enumerate(ty_data):
+        warnings = []
+        fingerprint = ty_fingerprint(entry)
+        entry['fingerprint'] = fingerprint
         
-        if isinstance(date_val, datetime):
-            date_obj = date_val
+        if fingerprint in seen:
+            warnings.append(f"Duplicate of row {seen[fingerprint]}")
         else:
-            try:
-                date_obj = datetime.strptime(str(date_val), "%Y-%m-%d %H:%M:%S")
-            except:
-                try:
-                    date_obj = datetime.strptime(str(date_val), "%Y-%m-%d")
-                except:
-                    continue
-        
-        ty_data.append({
-            'date': date_obj,
-            'route': route if route else "",
-            'work_details': work_details if work_details else "",
-            'pits_oh': pits_oh if pits_oh else "",
-            'amount': int(amount) if amount else 0
-        })
-    
-    if not ty_data:
-        return None, "No valid data found in the uploaded file"
-    
-    # Create new workbook
-    wb_new = openpyxl.Workbook()
-    ws = wb_new.active
-    ws.title = "Cash Receipts"
+            seen[fingerprint] = entry.get('row', index + 1)
+        
+        amount = entry['amount']
+        if amount <= 0:
+            warnings.append(f"Amount {amount} is not positive")
+        elif amount > MAX_PLAUSIBLE_AMOUNT:
+            warnings.append(f"Amount {amount} is above the {MAX_PLAUSIBLE_AMOUNT} limit")
+        elif len(ty_data) >= 5 and amount > AMOUNT_OUTLIER_FACTOR * average:
+            warnings.append(f"Amount {amount} is over {AMOUNT_OUTLIER_FACTOR}x the average of {average:.0f}")
+        
+        if not in_period(entry['date']):
+            warnings.append(f"Date {entry['date'].strftime('%d-%m-%Y')} is outside the sheet period ({period_label})")
+        
+        entry['warnings'] = warnings
     
-    # Set column widths
-    ws.column_dimensions['A'].width = 15
-    for col in ['B', 'C', 'D', 'E', 'F', 'G', 'H']:
-        ws.column_dimensions[col].width = 12
-    
-    # Borders
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
+    # Entries already issued in earlier jobs (e.g. the same fault claimed last month)
+    if check_issued is not None:
+        issued = check_issued(list(seen))
+        for entry in ty_data:
+            if entry['fingerprint'] in issued:
+                entry['warnings'].append(f"Already issued as {issued[entry['fingerprint']]}")
     
-    current_row = 1
+    return sum(len(entry['warnings']) for entry in ty_data)
+
+def build_receipt_records(ty_data, timer=NULL_TIMER, office=DEFAULT_OFFICE):
+    """Assign contractors and build one receipt record per TY Adv Appl entry.
+
+    The records are used for the preview and by every output writer
+    (Excel, PDF), so all of them show the same contractor and text.
+    Contractors come from the office's pools.
+    """
+    records = []
     voucher_no = 1
     
     # Track contractor assignments per day to ensure variety
@@ -300,6 +498,7 @@ def generate_receipts(input_file):
             pits_oh_value = ''
         pits_oh_lower = str(pits_oh_value).lower()
         is_pits = 'pit' in pits_oh_lower
+        work_type = "PITS Work" if is_pits else "OH Cable Work"
         
         # Ensure date is datetime object
         date_obj = entry['date']
@@ -312,220 +511,510 @@ def generate_receipts(input_file):
                 except:
                     date_obj = datetime.now()
         
-        # Select contractor based on work type and date
-        date_key = date_obj.strftime('%Y-%m-%d')
-        
-        # Get appropriate contractor list
-        contractor_pool = CONTRACTORS_PITS if is_pits else CONTRACTORS_OH_CABLE
-        
-        # Try to assign different contractor per day
-        if date_key in contractor_assignments:
-            # Exclude already used contractor for this date
-            available = [c for c in contractor_pool if c != contractor_assignments.get(date_key)]
-            contractor_name = random.choice(available) if available else random.choice(contractor_pool)
-        else:
-            contractor_name = random.choice(contractor_pool)
-        
-        # Store assignment
-        contractor_assignments[date_key] = contractor_name
-        
-        if is_pits:
-            description = generate_description_pits(date_obj, entry['work_details'], 
-                                                   entry['route'], entry['amount'], contractor_name)
-        else:
-            description = generate_description_oh_cable(date_obj, entry['work_details'], 
-                                                        entry['route'], entry['amount'], contractor_name)
+        with timer.stage('contractor'):
+            # Select contractor based on work type and date
+            date_key = date_obj.strftime('%Y-%m-%d')
+            
+            # Get appropriate contractor list
+            contractor_pool = office.contractor_pool(is_pits)
+            
+            # Try to assign different contractor per day
+            if date_key in contractor_assignments:
+                # Exclude already used contractor for this date
+                available = [c for c in contractor_pool if c != contractor_assignments.get(date_key)]
+                contractor_name = random.choice(available) if available else random.choice(contractor_pool)
+            else:
+                contractor_name = random.choice(contractor_pool)
+            
+            # Store assignment
+            contractor_assignments[date_key] = contractor_name
         
-        amount_words = number_to_words(entry['amount'])
+        with timer.stage('describe'):
+            if is_pits:
+                description = generate_description_pits(date_obj, entry['work_details'], 
+                                                       entry['route'], entry['amount'], contractor_name)
+            else:
+                description = generate_description_oh_cable(date_obj, entry['work_details'], 
+                                                            entry['route'], entry['amount'], contractor_name)
+            
+            amount_words = number_to_words(entry['amount'])
         
-        # Row 1: CASH RECEIPT
+        records.append({
+            'voucher_no': voucher_no,
+            'date': date_obj.strftime('%d-%m-%Y'),
+            'work_type': work_type,
+            'contractor': contractor_name,
+            'description': description,
+            'amount': entry['amount'],
+            'amount_words': amount_words,
+            'route': entry['route'],
+            'reason': REASON_LABELS[fault_reason(entry['work_details'], is_pits)],
+            'fingerprint': entry.get('fingerprint', ''),
+            'warnings': entry.get('warnings', [])
+        })
+        voucher_no += 1
+    
+    return records
+
+def write_receipt_block(ws, current_row, receipt, thin_border, office=DEFAULT_OFFICE):
+    """Draw one 12-row voucher starting at current_row, return the next free row"""
+    from openpyxl.styles import Font, Alignment
+    
+    date_obj = datetime.strptime(receipt['date'], '%d-%m-%Y')
+    amount_words = receipt['amount_words']
+    
+    # Row 1: CASH RECEIPT
+    ws.merge_cells(f'A{current_row}:H{current_row}')
+    cell = ws[f'A{current_row}']
+    cell.value = "CASH RECEIPT"
+    cell.font = Font(bold=True, size=14)
+    cell.alignment = Alignment(horizontal='center', vertical='center')
+    # Set rather than left to auto-size, so the page breaks count what is printed
+    ws.row_dimensions[current_row].height = TITLE_ROW_HEIGHT
+    for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:
+        ws[f'{col}{current_row}'].border = thin_border
+    current_row += 1
+    
+    # Row 2: Date and Voucher No
+    ws[f'A{current_row}'] = "Date"
+    ws[f'A{current_row}'].border = thin_border
+    ws[f'A{current_row}'].alignment = Alignment(horizontal='left', vertical='center')
+    
+    ws[f'B{current_row}'] = date_obj
+    ws[f'B{current_row}'].number_format = 'DD-MM-YYYY'
+    ws[f'B{current_row}'].border = thin_border
+    ws[f'B{current_row}'].alignment = Alignment(horizontal='left', vertical='center')
+    
+    ws.merge_cells(f'C{current_row}:F{current_row}')
+    for col in ['C', 'D', 'E', 'F']:
+        ws[f'{col}{current_row}'].border = thin_border
+    
+    ws[f'G{current_row}'] = "Voucher No:"
+    ws[f'G{current_row}'].border = thin_border
+    ws[f'G{current_row}'].alignment = Alignment(horizontal='right', vertical='center')
+    
+    ws[f'H{current_row}'] = receipt['voucher_no']
+    ws[f'H{current_row}'].border = thin_border
+    ws[f'H{current_row}'].alignment = Alignment(horizontal='center', vertical='center')
+    current_row += 1
+    
+    # Row 3: Received from
+    ws.merge_cells(f'A{current_row}:H{current_row}')
+    cell = ws[f'A{current_row}']
+    cell.value = f"Received from {office.payer}  Sum of Rupees {receipt['amount']}/-"
+    cell.alignment = Alignment(horizontal='left', vertical='center')
+    for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:
+        ws[f'{col}{current_row}'].border = thin_border
+    current_row += 1
+    
+    # Row 4: Description
+    ws.merge_cells(f'A{current_row}:H{current_row}')
+    cell = ws[f'A{current_row}']
+    cell.value = receipt['description']
+    cell.alignment = Alignment(horizontal='left', vertical='top', wrap_text=True)
+    ws.row_dimensions[current_row].height = DESCRIPTION_ROW_HEIGHT
+    for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:
+        ws[f'{col}{current_row}'].border = thin_border
+    current_row += 1
+    
+    # Row 5: RS and Amount
+    ws[f'A{current_row}'] = "RS"
+    ws[f'A{current_row}'].border = thin_border
+    ws[f'A{current_row}'].alignment = Alignment(horizontal='left', vertical='center')
+    
+    ws.merge_cells(f'B{current_row}:H{current_row}')
+    cell = ws[f'B{current_row}']
+    cell.value = receipt['amount']
+    cell.alignment = Alignment(horizontal='left', vertical='center')
+    for col in ['B', 'C', 'D', 'E', 'F', 'G', 'H']:
+        ws[f'{col}{current_row}'].border = thin_border
+    current_row += 1
+    
+    # Row 6: Amount in words + Signatures
+    ws.merge_cells(f'A{current_row}:D{current_row}')
+    cell = ws[f'A{current_row}']
+    cell.value = f"Rupees {amount_words} only"
+    cell.alignment = Alignment(horizontal='center', vertical='center')
+    for col in ['A', 'B', 'C', 'D']:
+        ws[f'{col}{current_row}'].border = thin_border
+    
+    ws.merge_cells(f'E{current_row}:F{current_row}')
+    cell = ws[f'E{current_row}']
+    cell.value = "Signature of Payee"
+    cell.alignment = Alignment(horizontal='center', vertical='center')
+    for col in ['E', 'F']:
+        ws[f'{col}{current_row}'].border = thin_border
+    
+    ws.merge_cells(f'G{current_row}:H{current_row}')
+    cell = ws[f'G{current_row}']
+    cell.value = "Signature of witness"
+    cell.alignment = Alignment(horizontal='center', vertical='center')
+    for col in ['G', 'H']:
+        ws[f'{col}{current_row}'].border = thin_border
+    current_row += 1
+    
+    # Rows 7-12: Standard clauses
+    for text in [
+        "1. Labour Engaged is Justified",
+        "2.Work is done satisfactorily",
+        f"3.Provision Exists in the estimate {office.grant}",
+        office.budget_head(receipt['work_type']),
+        f"Passed and Paid for Rs. {receipt['amount']}/-",
+        f"(Rupees {amount_words.title()} only)"
+    ]:
         ws.merge_cells(f'A{current_row}:H{current_row}')
         cell = ws[f'A{current_row}']
-        cell.value = "CASH RECEIPT"
-        cell.font = Font(bold=True, size=14)
+        cell.value = text
         cell.alignment = Alignment(horizontal='center', vertical='center')
         for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:
             ws[f'{col}{current_row}'].border = thin_border
         current_row += 1
+    
+    return current_row
+
+def shard_key(receipt, shard_by):
+    """Return the shard (worksheet) a receipt belongs to"""
+    if shard_by == 'month':
+        return datetime.strptime(receipt['date'], '%d-%m-%Y').strftime('%b-%Y')
+    if shard_by == 'date':
+        return receipt['date']
+    if shard_by == 'contractor':
+        # Contractor names are "Name, Street, Town" - the name part is enough
+        return receipt['contractor'].split(',')[0].strip()
+    return "Cash Receipts"
+
+def safe_sheet_title(title, used_titles):
+    """Make a valid, unique Excel sheet title (max 31 chars, no []:*?/\\)"""
+    title = re.sub(r'[\[\]:*?/\\]', '-', title).strip("' ") or "Sheet"
+    title = title[:31]
+    candidate = title
+    suffix = 2
+    while candidate.lower() in used_titles:
+        tail = f' ({suffix})'
+        candidate = title[:31 - len(tail)] + tail
+        suffix += 1
+    used_titles.add(candidate.lower())
+    return candidate
+
+def new_receipts_sheet(wb, title, column_widths=RECEIPT_COLUMN_WIDTHS):
+    """Add a worksheet laid out for vouchers (column widths A-H)"""
+    ws = wb.create_sheet(title)
+    
+    # Set column widths
+    for col, width in column_widths.items():
+        ws.column_dimensions[col].width = width
+    
+    return ws
+
+def compute_print_layout(column_widths=RECEIPT_COLUMN_WIDTHS, voucher_height=VOUCHER_HEIGHT):
+    """Work out print scale and whole vouchers per page from the voucher geometry.
+
+    Column widths are in characters; Excel renders a width w as about
+    (w * 7 + 5) pixels of Calibri 11, i.e. 0.75pt per pixel.
+    voucher_height is in points. Returns (scale_percent, vouchers_per_page).
+    """
+    content_width = sum((w * 7 + 5) * 0.75 for w in column_widths.values())
+    usable_width = PAGE_WIDTH - 2 * PAGE_MARGIN * 72
+    usable_height = PAGE_HEIGHT - 2 * PAGE_MARGIN * 72
+    
+    scale = min(100, int(usable_width / content_width * 100))
+    
+    # Height available for rows once the sheet is scaled down to fit the width
+    scaled_height = usable_height * 100 / scale
+    per_page = int((scaled_height + VOUCHER_SPACING) // (voucher_height + VOUCHER_SPACING))
+    
+    return scale, max(1, per_page)
+
+def apply_page_setup(ws, last_row, scale, last_column='H'):
+    """Set paper, margins, print area and page header/footer for a receipts sheet"""
+    ws.page_setup.paperSize = ws.PAPERSIZE_A4
+    ws.page_setup.orientation = ws.ORIENTATION_PORTRAIT
+    ws.page_setup.scale = scale
+    ws.page_margins.left = PAGE_MARGIN
+    ws.page_margins.right = PAGE_MARGIN
+    ws.page_margins.top = PAGE_MARGIN
+    ws.page_margins.bottom = PAGE_MARGIN
+    ws.page_margins.header = HEADER_MARGIN
+    ws.page_margins.footer = HEADER_MARGIN
+    ws.print_options.horizontalCentered = True
+    if last_row >= 1:
+        ws.print_area = f'A1:{last_column}{last_row}'
+    ws.oddHeader.center.text = ws.title
+    ws.oddFooter.center.text = "Page &P of &N"
+
+def write_index_sheet(ws, shards):
+    """Fill the index sheet with one hyperlinked row per shard and totals"""
+    from openpyxl.styles import Font
+    from openpyxl.worksheet.hyperlink import Hyperlink
+    
+    ws.column_dimensions['A'].width = 34
+    for col in ['B', 'C', 'D', 'E']:
+        ws.column_dimensions[col].width = 14
+    
+    header_font = Font(bold=True)
+    link_font = Font(color='0563C1', underline='single')
+    
+    for col, heading in zip(['A', 'B', 'C', 'D', 'E'],
+                            ['Sheet', 'Receipts', 'Total Amount', 'First Voucher', 'Last Voucher']):
+        ws[f'{col}1'] = heading
+        ws[f'{col}1'].font = header_font
+    
+    row = 2
+    for shard in shards.values():
+        cell = ws[f'A{row}']
+        cell.value = shard['title']
+        # Quotes in a sheet name are doubled inside the quoted reference
+        sheet_ref = shard['title'].replace("'", "''")
+        cell.hyperlink = Hyperlink(ref=cell.coordinate, location=f"'{sheet_ref}'!A1")
+        cell.font = link_font
+        ws[f'B{row}'] = shard['count']
+        ws[f'C{row}'] = shard['total']
+        ws[f'D{row}'] = shard['first_voucher']
+        ws[f'E{row}'] = shard['last_voucher']
+        row += 1
+    
+    ws[f'A{row}'] = "Total"
+    ws[f'A{row}'].font = header_font
+    ws[f'B{row}'] = sum(shard['count'] for shard in shards.values())
+    ws[f'C{row}'] = sum(shard['total'] for shard in shards.values())
+    ws[f'B{row}'].font = header_font
+    ws[f'C{row}'].font = header_font
+    ws.freeze_panes = 'A2'
+    
+    # Repeat the heading row on every printed page
+    ws.print_title_rows = '1:1'
+    ws.page_setup.paperSize = ws.PAPERSIZE_A4
+    ws.page_setup.fitToWidth = 1
+    ws.page_setup.fitToHeight = 0
+    ws.sheet_properties.pageSetUpPr.fitToPage = True
+
+class ReceiptsWorkbookWriter:
+    """Build the Cash Receipts workbook one receipt record at a time
+
+    With shard_by ('month', 'date' or 'contractor') the vouchers are split
+    across one worksheet per shard, and an Index sheet links to each one
+    with its receipt count and total amount. This keeps every sheet small
+    enough to stay responsive in Excel/LibreOffice for large books.
+
+    Page setup is worked out while rendering: a manual page break goes after
+    every vouchers_per_page vouchers so no voucher is split across pages.
+    Drawing per record lets the streamed preview show each voucher as soon
+    as it is in the workbook.
+
+    With a template (receipt_template.VoucherTemplate) each voucher is a
+    copy of the office's own voucher block instead of the built-in layout.
+    With analytics, totals per contractor, route and fault reason are
+    added up as the vouchers are drawn and written to an Analytics sheet.
+    """
+    
+    def __init__(self, timer=NULL_TIMER, shard_by=None, office=DEFAULT_OFFICE, template=None,
+                 analytics=False):
+        import openpyxl
+        from openpyxl.styles import Border, Side
         
-        # Row 2: Date and Voucher No
-        ws[f'A{current_row}'] = "Date"
-        ws[f'A{current_row}'].border = thin_border
-        ws[f'A{current_row}'].alignment = Alignment(horizontal='left', vertical='center')
+        self.timer = timer
+        self.shard_by = shard_by
+        self.office = office
+        self.template = template
+        self.report = ReceiptAggregates() if analytics else None
         
-        ws[f'B{current_row}'] = date_obj
-        ws[f'B{current_row}'].number_format = 'DD-MM-YYYY'
-        ws[f'B{current_row}'].border = thin_border
-        ws[f'B{current_row}'].alignment = Alignment(horizontal='left', vertical='center')
+        # Create new workbook (a template's workbook brings its styles along)
+        if template is not None:
+            self.wb = template.new_workbook()
+            self.column_widths = template.column_widths
+            self.last_column = template.last_column
+            voucher_height = template.height
+        else:
+            self.wb = openpyxl.Workbook()
+            self.wb.remove(self.wb.active)
+            self.column_widths = RECEIPT_COLUMN_WIDTHS
+            self.last_column = 'H'
+            voucher_height = VOUCHER_HEIGHT
         
-        ws.merge_cells(f'C{current_row}:F{current_row}')
-        for col in ['C', 'D', 'E', 'F']:
-            ws[f'{col}{current_row}'].border = thin_border
+        if shard_by in SHARD_MODES:
+            self.index_ws = self.wb.create_sheet("Index")
+        else:
+            self.index_ws = None
         
-        ws[f'G{current_row}'] = "Voucher No:"
-        ws[f'G{current_row}'].border = thin_border
-        ws[f'G{current_row}'].alignment = Alignment(horizontal='right', vertical='center')
+        # Borders
+        self.thin_border = Border(
+            left=Side(style='thin'),
+            right=Side(style='thin'),
+            top=Side(style='thin'),
+            bottom=Side(style='thin')
+        )
         
-        ws[f'H{current_row}'] = voucher_no
-        ws[f'H{current_row}'].border = thin_border
-        ws[f'H{current_row}'].alignment = Alignment(horizontal='center', vertical='center')
-        current_row += 1
+        self.scale, self.vouchers_per_page = compute_print_layout(self.column_widths, voucher_height)
         
-        # Row 3: Received from
-        ws.merge_cells(f'A{current_row}:H{current_row}')
-        cell = ws[f'A{current_row}']
-        cell.value = f"Received from SDE (Txn), Tumkur  Sum of Rupees {entry['amount']}/-"
-        cell.alignment = Alignment(horizontal='left', vertical='center')
-        for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:
-            ws[f'{col}{current_row}'].border = thin_border
-        current_row += 1
+        # Per-shard worksheet and write position
+        self.shards = {}
+        self.used_titles = {"index"} if self.index_ws is not None else set()
+    
+    def add(self, receipt):
+        """Draw one voucher on the sheet of its shard"""
+        from openpyxl.worksheet.pagebreak import Break
         
-        # Row 4: Description
-        ws.merge_cells(f'A{current_row}:H{current_row}')
-        cell = ws[f'A{current_row}']
-        cell.value = description
-        cell.alignment = Alignment(horizontal='left', vertical='top', wrap_text=True)
-        ws.row_dimensions[current_row].height = 75
-        for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:
-            ws[f'{col}{current_row}'].border = thin_border
-        current_row += 1
+        key = shard_key(receipt, self.shard_by)
+        shard = self.shards.get(key)
+        if shard is None:
+            title = safe_sheet_title(key, self.used_titles)
+            shard = self.shards[key] = {
+                'title': title,
+                'ws': new_receipts_sheet(self.wb, title, self.column_widths),
+                'current_row': 1,
+                'count': 0,
+                'total': 0,
+                'first_voucher': receipt['voucher_no'],
+                'last_voucher': receipt['voucher_no'],
+            }
         
-        # Row 5: RS and Amount
-        ws[f'A{current_row}'] = "RS"
-        ws[f'A{current_row}'].border = thin_border
-        ws[f'A{current_row}'].alignment = Alignment(horizontal='left', vertical='center')
+        with self.timer.stage('render'):
+            if self.template is not None:
+                shard['current_row'] = self.template.write_block(shard['ws'], shard['current_row'], receipt,
+                                                                 self.office)
+            else:
+                shard['current_row'] = write_receipt_block(shard['ws'], shard['current_row'], receipt,
+                                                            self.thin_border, self.office)
         
-        ws.merge_cells(f'B{current_row}:H{current_row}')
-        cell = ws[f'B{current_row}']
-        cell.value = entry['amount']
-        cell.alignment = Alignment(horizontal='left', vertical='center')
-        for col in ['B', 'C', 'D', 'E', 'F', 'G', 'H']:
-            ws[f'{col}{current_row}'].border = thin_border
-        current_row += 1
+        if self.report is not None:
+            self.report.add_receipt(receipt)
         
-        # Row 6: Amount in words + Signatures
-        ws.merge_cells(f'A{current_row}:D{current_row}')
-        cell = ws[f'A{current_row}']
-        cell.value = f"Rupees {amount_words} only"
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        for col in ['A', 'B', 'C', 'D']:
-            ws[f'{col}{current_row}'].border = thin_border
+        shard['count'] += 1
+        shard['total'] += receipt['amount']
+        shard['last_voucher'] = receipt['voucher_no']
+        shard['last_row'] = shard['current_row'] - 1
         
-        ws.merge_cells(f'E{current_row}:F{current_row}')
-        cell = ws[f'E{current_row}']
-        cell.value = "Signature of Payee"
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        for col in ['E', 'F']:
-            ws[f'{col}{current_row}'].border = thin_border
+        # Page break after the last row of every full page of vouchers
+        if shard['count'] % self.vouchers_per_page == 0:
+            shard['ws'].row_breaks.append(Break(id=shard['last_row']))
         
-        ws.merge_cells(f'G{current_row}:H{current_row}')
-        cell = ws[f'G{current_row}']
-        cell.value = "Signature of witness"
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        for col in ['G', 'H']:
-            ws[f'{col}{current_row}'].border = thin_border
-        current_row += 1
+        shard['current_row'] += VOUCHER_SPACING_ROWS
+    
+    def finish(self):
+        """Apply page setup, fill the index sheet and return the workbook"""
+        for shard in self.shards.values():
+            apply_page_setup(shard['ws'], shard.get('last_row', 0), self.scale, self.last_column)
         
-        # Rows 7-12: Standard clauses
-        for text in [
-            "1. Labour Engaged is Justified",
-            "2.Work is done satisfactorily",
-            "3.Provision Exists in the estimate Maintainnace Grant",
-            "RM Cables / TMR/LABOUR/5020819",
-            f"Passed and Paid for Rs. {entry['amount']}/-",
-            f"(Rupees {amount_words.title()} only)"
-        ]:
-            ws.merge_cells(f'A{current_row}:H{current_row}')
-            cell = ws[f'A{current_row}']
-            cell.value = text
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']:
-                ws[f'{col}{current_row}'].border = thin_border
-            current_row += 1
-        
-        current_row += 2
-        voucher_no += 1
+        if self.index_ws is not None:
+            write_index_sheet(self.index_ws, self.shards)
+        
+        if self.report is not None:
+            self.report.write_sheet(self.wb.create_sheet("Analytics"))
+        
+        return self.wb
+
+def write_receipts_workbook(records, timer=NULL_TIMER, shard_by=None, office=DEFAULT_OFFICE, template=None,
+                            analytics=False):
+    """Build the Cash Receipts workbook from receipt records (see ReceiptsWorkbookWriter)"""
+    writer = ReceiptsWorkbookWriter(timer, shard_by, office, template, analytics)
+    for receipt in records:
+        writer.add(receipt)
+    return writer.finish()
+
+def generate_receipts(input_file, timer=NULL_TIMER, with_workbook=True, shard_by=None,
+                      assign_numbers=None, check_issued=None, office=DEFAULT_OFFICE, template=None,
+                      analytics=False):
+    """Generate cash receipts from uploaded Excel file
+
+    Returns (workbook, error, receipts_count, preview_data). The workbook is
+    None when with_workbook is False (e.g. PDF-only output). shard_by splits
+    the workbook into one sheet per month, date or contractor.
+    assign_numbers, if given, is called with the receipt records before
+    anything is rendered so it can replace their voucher numbers.
+    check_issued is passed on to validate_ty_data to find entries that were
+    already issued in earlier jobs. office supplies the contractors and the
+    voucher text; template, if given, is the voucher block the workbook
+    copies for each receipt. analytics adds the Analytics totals sheet.
+    """
+    with timer.stage('parse'):
+        ty_data, rows_read, period = read_ty_data(input_file)
     
-    wb_source.close()
+    if not ty_data:
+        return None, "No valid data found in the uploaded file", 0, []
     
-    # Prepare preview data (all receipts with full details)
-    preview_data = []
-    contractor_preview_assignments = {}
-    voucher_no_preview = 1
+    # Catch duplicates and bad rows before anything is rendered
+    with timer.stage('validate'):
+        validate_ty_data(ty_data, period, check_issued)
     
-    for i, entry in enumerate(ty_data):
-        # Safely handle pits_oh field (might be int, None, or string)
-        pits_oh_value = entry.get('pits_oh', '')
-        if pits_oh_value is None:
-            pits_oh_value = ''
-        pits_oh_lower = str(pits_oh_value).lower()
-        is_pits = 'pit' in pits_oh_lower
-        work_type = "PITS Work" if is_pits else "OH Cable Work"
+    # Receipt records double as preview data (all receipts with full details)
+    preview_data = build_receipt_records(ty_data, timer, office)
+    
+    if assign_numbers is not None:
+        with timer.stage('ledger'):
+            assign_numbers(preview_data)
+    
+    wb_new = (write_receipts_workbook(preview_data, timer, shard_by, office, template, analytics)
+              if with_workbook else None)
+    
+    timer.record_counts(rows=rows_read, receipts=len(ty_data))
+    
+    return wb_new, None, len(ty_data), preview_data
+
+def stream_page(template_name, **context):
+    """Send a template in chunks as it renders instead of building the whole page.
+
+    Loops in the template pull from context iterables lazily, so a generator
+    of receipts is rendered card by card as it produces them.
+    """
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(**context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+    response = Response(stream_with_context(stream), mimetype='text/html')
+    # Ask proxies (nginx) not to hold the page back until it is complete
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def generate_while_streaming(records, job, timer, shard_by=None, output_path=None, pdf_path=None,
+                             office=DEFAULT_OFFICE, template=None, analytics=False, report_path=None,
+                             outputs=None, ledger=None):
+    """Yield receipt records for the streamed preview, drawing each into the workbook first.
+
+    The outputs are saved once the last card has been sent. Errors are
+    stored in job['error'] so the page can report them at the bottom.
+    outputs, if given, is the job's OutputJob: its files are published
+    when all are written (and its pending vouchers in ledger committed),
+    and its work folder is removed at the end (voiding vouchers that were
+    never committed).
+    """
+    try:
+        writer = ReceiptsWorkbookWriter(timer, shard_by, office, template, analytics) if output_path else None
+        for receipt in records:
+            if writer is not None:
+                writer.add(receipt)
+            yield receipt
         
-        # Handle date formatting safely
-        date_obj = entry['date']
-        if isinstance(date_obj, str):
-            try:
-                date_obj = datetime.strptime(date_obj, '%Y-%m-%d')
-            except:
-                try:
-                    date_obj = datetime.strptime(date_obj, '%d-%m-%Y')
-                except:
-                    date_obj = datetime.now()
+        if writer is not None:
+            with timer.stage('save'):
+                wb_output = writer.finish()
+                wb_output.save(output_path)
+                wb_output.close()
         
-        # Select contractor for preview (same logic as main generation)
-        date_key = date_obj.strftime('%Y-%m-%d')
-        work_key = f"{date_key}_{work_type}"
+        if pdf_path:
+            with timer.stage('pdf'):
+                write_receipts_pdf(records, pdf_path, office)
         
-        if work_key in contractor_preview_assignments:
-            selected_contractor = contractor_preview_assignments[work_key]
-        else:
-            contractor_pool = CONTRACTORS_PITS if is_pits else CONTRACTORS_OH_CABLE
-            date_contractors = [v for k, v in contractor_preview_assignments.items() if k.startswith(date_key)]
-            available = [c for c in contractor_pool if c not in date_contractors]
-            if not available:
-                available = contractor_pool
-            selected_contractor = random.choice(available)
-            contractor_preview_assignments[work_key] = selected_contractor
-        
-        # Generate description
-        date_formatted = date_obj.strftime('%d-%m-%Y')
-        if is_pits:
-            description = generate_description_pits(
-                date_formatted,
-                entry['work_details'],
-                entry['route'],
-                entry['amount'],
-                selected_contractor
-            )
-        else:
-            description = generate_description_oh_cable(
-                date_formatted,
-                entry['work_details'],
-                entry['route'],
-                entry['amount'],
-                selected_contractor
-            )
-        
-        amount_words = number_to_words(entry['amount'])
-        
-        preview_data.append({
-            'voucher_no': voucher_no_preview,
-            'date': date_formatted,
-            'work_type': work_type,
-            'contractor': selected_contractor,
-            'description': description,
-            'amount': entry['amount'],
-            'amount_words': amount_words,
-            'route': entry['route']
-        })
-        voucher_no_preview += 1
-    
-    return wb_new, None, len(ty_data), preview_data
+        if report_path:
+            with timer.stage('report'):
+                aggregate_receipts(records).write_csv(report_path)
+        
+        if outputs is not None:
+            publish_job(outputs, ledger)
+        
+        timer.finish()
+    except GeneratorExit:
+        # Client went away mid-page
+        timer.finish(ok=False)
+        raise
+    except Exception as e:
+        job['error'] = f'Error processing file: {str(e)}'
+        timer.finish(ok=False)
+    finally:
+        if outputs is not None:
+            discard_job(outputs, ledger)
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', offices=list(OFFICES.values()), selected_office=session.get('office'))
 
 @app.route('/generate', methods=['POST'])
 def generate():
@@ -539,73 +1028,239 @@ def generate():
         flash('No file selected', 'error')
         return redirect(url_for('index'))
     
+    office = get_office(request.form.get('office'))
+    if office is None:
+        flash('Unknown office selected', 'error')
+        return redirect(url_for('index'))
+    
     if file and allowed_file(file.filename):
+        # One office's bulk jobs must not take every worker from the others
         try:
+            slot = office.acquire_job()
+        except OfficeBusy as e:
+            flash(str(e), 'error')
+            return redirect(url_for('index'))
+        
+        timer = receipt_metrics.start_job(file.filename)
+        # A streamed page gives its job slot back when the response closes
+        slot_handed_off = False
+        outputs = ledger = None
+        try:
+            output_folder = office_output_folder(office)
+            evict_outputs()
+            
             # Get original filename without extension
             original_name = os.path.splitext(file.filename)[0]
             
-            wb_output, error, receipts_count, preview_data = generate_receipts(file)
+            # Excel workbook, PDF, or both
+            output_format = request.form.get('output_format', 'xlsx')
+            if output_format not in OUTPUT_FORMATS:
+                output_format = 'xlsx'
+            with_workbook = output_format in ('xlsx', 'both')
+            
+            # Optionally split vouchers into one sheet per month/date/contractor
+            shard_by = request.form.get('shard_by') or None
+            if shard_by not in SHARD_MODES:
+                shard_by = None
+            
+            # Official voucher template: uploaded with the file, or the office's own
+            template = None
+            template_file = request.files.get('template_file')
+            if template_file is not None and template_file.filename:
+                if not template_file.filename.lower().endswith('.xlsx'):
+                    timer.finish(ok=False)
+                    flash('The voucher template must be an .xlsx workbook', 'error')
+                    return redirect(url_for('index'))
+                template = load_template(template_file.read())
+            elif office.template:
+                template = get_office_template(office)
+            
+            # Totals per contractor/route/fault reason: Analytics sheet, CSV or both
+            report_mode = request.form.get('report') or None
+            if report_mode not in REPORT_MODES:
+                report_mode = None
+            analytics = report_mode in ('sheet', 'both') and with_workbook
+            
+            # Send the preview page while the receipts are drawn (profiling needs the whole run)
+            stream_preview = (request.form.get('preview_mode') == 'stream'
+                              and not receipt_profiling.profiling_requested(request.headers))
+            
+            # Generate filename based on uploaded file name. Files are written in the
+            # job's own work folder and renamed into the output folder when complete.
+            outputs = reserve_job(output_folder, f'{original_name}_cash_receipt_', JOB_FILE_SUFFIXES)
+            job_name = outputs.name
+            output_filename = f'{job_name}.xlsx'
+            output_path = outputs.path(output_filename)
+            # Without a workbook the totals go to the CSV
+            report_filename = (f'{job_name}_totals.csv'
+                               if report_mode == 'both' or (report_mode and not analytics) else None)
+            
+            # Continuous voucher numbers from the office's ledger
+            ledger = get_voucher_ledger(office)
+            assign_numbers = None
+            if ledger is not None:
+                source_file = file.filename
+                # Pending until the job's files are published, voided if it fails
+                assign_numbers = lambda records: ledger.issue(records, job_name, source_file, pending=True)
+            
+            # Optionally profile this one request (admin header or env var)
+            options = dict(with_workbook=with_workbook and not stream_preview, shard_by=shard_by,
+                           assign_numbers=assign_numbers,
+                           check_issued=ledger.find_fingerprints if ledger else None, office=office,
+                           template=template, analytics=analytics)
+            profile_files = []
+            if receipt_profiling.profiling_requested(request.headers):
+                result, profiler, snapshot = receipt_profiling.profile_call(
+                    generate_receipts, file, timer, **options)
+                profile_files = receipt_profiling.save_profile(
+                    profiler, snapshot, outputs.work_dir, job_name)
+            else:
+                result = generate_receipts(file, timer, **options)
+            
+            wb_output, error, receipts_count, preview_data = result
             
             if error:
+                timer.finish(ok=False)
                 flash(error, 'error')
                 return redirect(url_for('index'))
             
-            # Generate filename based on uploaded file name
-            unique_id = str(uuid.uuid4())[:8]
-            output_filename = f'{original_name}_cash_receipt_{unique_id}.xlsx'
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+            if stream_preview:
+                pdf_filename = f'{job_name}.pdf'
+                generated_files = ([output_filename] if with_workbook else []) + \
+                                  ([pdf_filename] if output_format in ('pdf', 'both') else []) + \
+                                  ([report_filename] if report_filename else [])
+                
+                # The session cookie goes out with the headers, so store the job up front
+                with timer.stage('session'):
+                    store_job_in_session(generated_files, receipts_count, preview_data,
+                                         file.filename, profile_files, office)
+                
+                job = {'error': None}
+                receipts = generate_while_streaming(
+                    preview_data, job, timer, shard_by,
+                    output_path if with_workbook else None,
+                    outputs.path(pdf_filename) if pdf_filename in generated_files else None,
+                    office, template, analytics,
+                    outputs.path(report_filename) if report_filename else None, outputs, ledger)
+                response = stream_page('preview.html', job=job, streaming=True,
+                                       **preview_context(receipts=receipts))
+                response.call_on_close(slot.release)
+                # Also when the page is dropped before the generator starts
+                dropped_outputs = outputs
+                response.call_on_close(lambda: discard_job(dropped_outputs, ledger))
+                slot_handed_off = True
+                outputs = None  # Published and removed by the generator
+                return response
+            
+            generated_files = []
             
             # Save the workbook
-            wb_output.save(output_path)
-            wb_output.close()
+            if wb_output is not None:
+                with timer.stage('save'):
+                    wb_output.save(output_path)
+                    wb_output.close()
+                generated_files.append(output_filename)
+            
+            # Write the PDF straight from the receipt records
+            if output_format in ('pdf', 'both'):
+                pdf_filename = f'{job_name}.pdf'
+                with timer.stage('pdf'):
+                    write_receipts_pdf(preview_data, outputs.path(pdf_filename), office)
+                generated_files.append(pdf_filename)
+            
+            # Totals per contractor, route and fault reason
+            if report_filename:
+                with timer.stage('report'):
+                    aggregate_receipts(preview_data).write_csv(outputs.path(report_filename))
+                generated_files.append(report_filename)
+            
+            # Every file is complete, make them all downloadable at once
+            publish_job(outputs, ledger)
             
             # Store data in session
-            session['generated_file'] = output_filename
-            session['receipts_count'] = receipts_count
-            session['preview_data'] = preview_data
-            session['original_filename'] = file.filename
+            with timer.stage('session'):
+                store_job_in_session(generated_files, receipts_count, preview_data,
+                                     file.filename, profile_files, office)
             
+            timer.finish()
             return redirect(url_for('preview'))
             
         except Exception as e:
+            timer.finish(ok=False)
             flash(f'Error processing file: {str(e)}', 'error')
             return redirect(url_for('index'))
+        finally:
+            if outputs is not None:
+                discard_job(outputs, ledger)
+            if not slot_handed_off:
+                slot.release()
     else:
         flash('Invalid file type. Please upload an Excel file (.xlsx or .xls)', 'error')
         return redirect(url_for('index'))
 
+def store_job_in_session(generated_files, receipts_count, preview_data, original_filename, profile_files,
+                         office=DEFAULT_OFFICE):
+    session['office'] = office.key
+    session['generated_file'] = generated_files[0]
+    session['generated_files'] = generated_files
+    session['receipts_count'] = receipts_count
+    session['preview_data'] = preview_data
+    session['original_filename'] = original_filename
+    session['profile_files'] = profile_files
+
+def preview_context(receipts=None):
+    """Template variables for preview.html from the job stored in the session.
+
+    receipts replaces the stored preview data for the cards, e.g. with a
+    generator when the page is streamed.
+    """
+    preview_data = session.get('preview_data', [])
+    return dict(office=session_office(),
+                filename=session['generated_file'],
+                generated_files=session.get('generated_files', [session['generated_file']]),
+                receipts_count=session.get('receipts_count', 0),
+                preview_data=preview_data if receipts is None else receipts,
+                flagged=[receipt for receipt in preview_data if receipt.get('warnings')],
+                original_filename=session.get('original_filename', 'Unknown'),
+                profile_files=session.get('profile_files', []))
+
+def session_office():
+    """Office of the job stored in the session"""
+    return get_office(session.get('office')) or DEFAULT_OFFICE
+
 @app.route('/preview')
 def preview():
     if 'generated_file' not in session:
         flash('No file to preview', 'error')
         return redirect(url_for('index'))
     
-    return render_template('preview.html',
-                         filename=session['generated_file'],
-                         receipts_count=session.get('receipts_count', 0),
-                         preview_data=session.get('preview_data', []),
-                         original_filename=session.get('original_filename', 'Unknown'))
+    # Cards are sent as they render, so a big job does not build the page in memory
+    return stream_page('preview.html', **preview_context())
 
 @app.route('/download/<filename>')
 def download(filename):
     try:
         # Security check - ensure filename is in session
-        if 'generated_file' not in session or session['generated_file'] != filename:
+        allowed_files = session.get('generated_files', [session.get('generated_file')])
+        if 'generated_file' not in session or filename not in allowed_files:
             flash('Invalid download request', 'error')
             return redirect(url_for('index'))
         
-        file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
+        file_path = os.path.join(session_office().output_folder(app.config['OUTPUT_FOLDER']), filename)
         
-        if not os.path.exists(file_path):
+        # Open first: a clean-up removing the file now cannot break the download
+        output_file = open_output(file_path)
+        if output_file is None:
             flash('File not found', 'error')
             return redirect(url_for('index'))
         
-        # Use original filename for download
-        download_name = session.get('generated_file', 'Cash_Receipts_Generated.xlsx')
+        # Use generated filename for download
+        download_name = filename
+        extension = os.path.splitext(filename)[1].lower()
         
         return send_file(
-            file_path,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            output_file,
+            mimetype=MIMETYPES.get(extension, 'application/octet-stream'),
             as_attachment=True,
             download_name=download_name
         )
@@ -613,6 +1268,401 @@ def download(filename):
         flash(f'Error downloading file: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+@app.route('/bundle')
+def bundle():
+    """All files of the session's job, or of every job with vouchers in a period, as one zip.
+
+    Query parameters (ledger jobs): office, date_from, date_to (YYYY-MM-DD), fy.
+    Period bundles need the admin token (X-Receipts-Admin header).
+    Without them the files of the job in the session are bundled.
+    """
+    args = request.args
+    if any(args.get(key) for key in ('date_from', 'date_to', 'fy')):
+        office = get_office(args.get('office'))
+        if office is None:
+            return jsonify(error=f"office must be one of {list(OFFICES)}"), 400
+        if not admin_authorized(office):
+            return jsonify(error=f'Period bundles need the admin token ({ADMIN_HEADER} header)'), 403
+        ledger = get_voucher_ledger(office)
+        if ledger is None:
+            return jsonify(error='Voucher ledger is disabled'), 404
+        try:
+            for key in ('date_from', 'date_to'):
+                if args.get(key):
+                    datetime.strptime(args[key], '%Y-%m-%d')
+        except ValueError:
+            return jsonify(error='Dates must be YYYY-MM-DD'), 400
+        jobs = [job['job'] for job in ledger.jobs(args.get('date_from'), args.get('date_to'), args.get('fy'))]
+        members = job_files(office_output_folder(office), jobs)
+        if not members:
+            return jsonify(error='No generated files for that period'), 404
+        period = args.get('fy') or f"{args.get('date_from') or 'start'}_to_{args.get('date_to') or 'end'}"
+        download_name = f'cash_receipts_{office.key}_{period}.zip'
+    else:
+        if 'generated_file' not in session:
+            flash('No file to download', 'error')
+            return redirect(url_for('index'))
+        office = session_office()
+        folder = office.output_folder(app.config['OUTPUT_FOLDER'])
+        members = [(os.path.join(folder, filename), filename)
+                   for filename in session.get('generated_files', [session['generated_file']])
+                   if os.path.exists(os.path.join(folder, filename))]
+        if not members:
+            flash('File not found', 'error')
+            return redirect(url_for('index'))
+        download_name = f"{os.path.splitext(session['generated_file'])[0]}.zip"
+    
+    # A download lasts as long as the auditor's link does, so bundles have their own
+    # limit rather than taking the slots /generate needs
+    try:
+        slot = office.acquire_bundle()
+    except OfficeBusy as e:
+        return jsonify(error=str(e)), 429, {'Retry-After': '5'}
+    
+    response = Response(stream_zip(members), mimetype=MIMETYPES['.zip'])
+    response.headers['Content-Disposition'] = f'attachment; filename="{secure_filename(download_name)}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(slot.release)
+    return response
+
+@app.route('/assets/<digest>/<path:filename>')
+def static_asset(digest, filename):
+    # Fingerprinted static files: cached for a year, compressed copy when accepted
+    path = static_assets.asset_path(filename)
+    if path is None or not os.path.isfile(path):
+        return 'Not found', 404
+    
+    variant, encoding = static_assets.pick_variant(filename, request.headers.get('Accept-Encoding', ''))
+    response = send_file(variant, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                         conditional=True, etag=True, max_age=0)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    # An old hash (page rendered before a deploy) still gets the file, just not cached
+    if digest == static_assets.fingerprint(filename):
+        response.headers['Cache-Control'] = static_assets.IMMUTABLE_CACHE
+    else:
+        response.headers['Cache-Control'] = static_assets.REVALIDATE_CACHE
+    return response
+
+@app.route('/profile/<filename>')
+def download_profile(filename):
+    # Only profile artifacts produced for this session's job can be fetched
+    if filename not in session.get('profile_files', []):
+        flash('Invalid download request', 'error')
+        return redirect(url_for('index'))
+    
+    file_path = os.path.join(session_office().output_folder(app.config['OUTPUT_FOLDER']), filename)
+    
+    output_file = open_output(file_path)
+    if output_file is None:
+        flash('File not found', 'error')
+        return redirect(url_for('index'))
+    
+    return send_file(output_file, as_attachment=True, download_name=filename)
+
+def json_rows_to_ty_data(rows):
+    """Convert JSON TY Adv Appl rows into entries, using the same rules as the sheet reader"""
+    if not isinstance(rows, list):
+        raise ValueError("'rows' must be a list of objects")
+    
+    ty_data = []
+    for row_num, row in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            raise ValueError("Each row must be a JSON object")
+        
+        # A sheet row may be a heading or a total, but every JSON row must be a receipt
+        for field in ('route', 'work_details', 'pits_oh'):
+            if row.get(field) is not None and not isinstance(row[field], str):
+                raise ValueError(f"Row {row_num}: {field} must be text, got {row[field]!r}")
+        
+        date_val = row.get('date')
+        if not isinstance(date_val, str):
+            raise ValueError(f"Row {row_num}: date must be DD-MM-YYYY or YYYY-MM-DD, got {date_val!r}")
+        # Accept DD-MM-YYYY (as printed on the receipts) as well as ISO dates
+        for date_format in ('%d-%m-%Y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S'):
+            try:
+                date_val = datetime.strptime(date_val, date_format)
+                break
+            except ValueError:
+                pass
+        else:
+            raise ValueError(f"Row {row_num}: date must be DD-MM-YYYY or YYYY-MM-DD, got {date_val!r}")
+        
+        try:
+            entry = parse_ty_row(date_val, row.get('route'), row.get('work_details'),
+                                 row.get('pits_oh'), row.get('amount'))
+        except (TypeError, ValueError):
+            raise ValueError(f"Row {row_num}: invalid amount {row.get('amount')!r}")
+        if entry is None:
+            if not row.get('amount'):
+                raise ValueError(f"Row {row_num}: amount is missing")
+            if row.get('work_details') is None:
+                raise ValueError(f"Row {row_num}: work_details is missing")
+            raise ValueError(f"Row {row_num}: work_details {row.get('work_details')!r} is not a receipt")
+        entry['row'] = row_num
+        ty_data.append(entry)
+    
+    return ty_data
+
+def collect_api_submissions():
+    """Read the submissions of an API call.
+
+    Accepts either multipart uploads (one or more 'file'/'files' fields) or a
+    JSON body: a list of rows, {"rows": [...]}, or
+    {"batches": [{"name": "...", "rows": [...]}, ...]} for many months at once.
+    Returns (submissions, is_batch) where each submission is (name, kind, payload).
+    """
+    uploads = request.files.getlist('file') + request.files.getlist('files')
+    if uploads:
+        submissions = []
+        for upload in uploads:
+            if not upload.filename or not allowed_file(upload.filename):
+                raise ValueError(f"Invalid file type: {upload.filename or '(no name)'}")
+            submissions.append((upload.filename, 'file', upload.read()))
+        return submissions, len(submissions) > 1
+    
+    body = request.get_json(silent=True)
+    if isinstance(body, list):
+        return [('rows', 'rows', body)], False
+    if isinstance(body, dict) and 'batches' in body:
+        batches = body['batches']
+        if not isinstance(batches, list) or not batches:
+            raise ValueError("'batches' must be a non-empty list")
+        submissions = []
+        for i, batch in enumerate(batches, 1):
+            if not isinstance(batch, dict):
+                raise ValueError("Each batch must be a JSON object")
+            submissions.append((str(batch.get('name') or f'batch-{i}'), 'rows', batch.get('rows')))
+        return submissions, True
+    if isinstance(body, dict) and 'rows' in body:
+        return [(str(body.get('name') or 'rows'), 'rows', body['rows'])], False
+    
+    raise ValueError("Upload an Excel file or send JSON rows")
+
+def api_etag(submissions, output_format, shard_by, office=DEFAULT_OFFICE):
+    """Strong ETag over everything that determines the response"""
+    digest = hashlib.sha256(f'{office.key}|{output_format}|{shard_by}'.encode())
+    for name, kind, payload in submissions:
+        digest.update(f'|{name}|{kind}|'.encode())
+        if kind == 'file':
+            digest.update(payload)
+        else:
+            digest.update(json.dumps(payload, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:32]
+
+def replay_vouchers(records, vouchers):
+    """Give records the numbers, contractors and text a ledger job already issued"""
+    if len(records) != len(vouchers):
+        raise RuntimeError(f"The ledger holds {len(vouchers)} vouchers for this input, not {len(records)}")
+    for record, voucher in zip(records, vouchers):
+        record['voucher_no'] = voucher['voucher_no']
+        record['financial_year'] = voucher['financial_year']
+        record['contractor'] = voucher['contractor']
+        record['description'] = voucher['description']
+    return records
+
+def build_api_response(submissions, is_batch, output_format, shard_by, timer, office=DEFAULT_OFFICE,
+                       ledger=None, job=None):
+    """Generate receipts for the submissions, return (body, mimetype) or raise ValueError.
+
+    With a ledger the receipts are numbered as ledger job `job`. If that job
+    was issued before (same input), its vouchers are returned again instead
+    of new ones; otherwise new vouchers count as issued once the response
+    is built.
+    """
+    issued = ledger.job_vouchers(job) if ledger is not None else []
+    check_issued = ledger.find_fingerprints if ledger is not None and not issued else None
+    results = []
+    for name, kind, payload in submissions:
+        with timer.stage('parse'):
+            if kind == 'file':
+                ty_data, _, period = read_ty_data(io.BytesIO(payload))
+            else:
+                ty_data, period = json_rows_to_ty_data(payload), None
+        
+        with timer.stage('validate'):
+            validate_ty_data(ty_data, period, check_issued)
+        
+        if not ty_data:
+            if not is_batch:
+                raise ValueError("No valid data found in the submitted rows")
+            results.append({'name': name, 'error': "No valid data found", 'receipts_count': 0, 'receipts': []})
+            continue
+        
+        records = build_receipt_records(ty_data, timer, office)
+        results.append({'name': name, 'receipts_count': len(records), 'receipts': records})
+    
+    total = sum(result['receipts_count'] for result in results)
+    timer.record_counts(rows=total, receipts=total)
+    
+    if output_format == 'xlsx' and is_batch:
+        raise ValueError("format=xlsx takes one submission per call")
+    
+    # Continuous voucher numbers from the office's ledger, the same ones for the same input
+    records = [record for result in results for record in result['receipts']]
+    pending = False
+    if ledger is not None and records:
+        with timer.stage('ledger'):
+            if issued:
+                replay_vouchers(records, issued)
+            else:
+                source_file = ', '.join(name for name, _, _ in submissions)[:200]
+                ledger.issue(records, job, source_file, pending=True)
+                pending = True
+    
+    try:
+        if output_format == 'xlsx':
+            wb = write_receipts_workbook(results[0]['receipts'], timer, shard_by, office)
+            buffer = io.BytesIO()
+            with timer.stage('save'):
+                wb.save(buffer)
+                wb.close()
+            response = buffer.getvalue(), MIMETYPES['.xlsx']
+        else:
+            if is_batch:
+                payload = {'receipts_count': total, 'batches': results}
+            else:
+                payload = {'source': results[0]['name'], 'receipts_count': total,
+                           'receipts': results[0]['receipts']}
+            response = json.dumps(payload).encode('utf-8'), 'application/json'
+    except Exception:
+        if pending:
+            ledger.void_job(job)
+        raise
+    if pending:
+        ledger.commit_job(job)
+    return response
+
+@app.route('/api/receipts', methods=['POST'])
+def api_receipts():
+    """Generate receipts without the HTML pages.
+
+    Query parameters:
+        format    json (default) for receipt records, or xlsx for the workbook
+        shard_by  month / date / contractor (xlsx only)
+        office    office profile key (default office when omitted)
+
+    Voucher numbers come from the office's ledger, like uploads. Contractors
+    are picked at random, so results are cached per ETag (in the office's
+    own cache) and recorded in the ledger as one job per input: sending the
+    same input again (in any format) returns the same receipts and numbers, and a matching
+    If-None-Match gets 304 Not Modified. When the office is at its job
+    limit the call gets 429 Too Many Requests.
+    """
+    output_format = request.args.get('format', 'json')
+    if output_format not in ('json', 'xlsx'):
+        return jsonify(error="format must be 'json' or 'xlsx'"), 400
+    shard_by = request.args.get('shard_by') or None
+    if shard_by is not None and shard_by not in SHARD_MODES:
+        return jsonify(error=f"shard_by must be one of {sorted(SHARD_MODES)}"), 400
+    office = get_office(request.args.get('office'))
+    if office is None:
+        return jsonify(error=f"office must be one of {list(OFFICES)}"), 400
+    
+    try:
+        submissions, is_batch = collect_api_submissions()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    
+    etag = api_etag(submissions, output_format, shard_by, office)
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'private, no-cache'}
+    
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    
+    cached = office.results.get(etag)
+    
+    if cached is None:
+        try:
+            slot = office.acquire_job()
+        except OfficeBusy as e:
+            return jsonify(error=str(e)), 429, {'Retry-After': '5'}
+        
+        timer = receipt_metrics.start_job('api')
+        try:
+            # One ledger job per input, whatever format it is asked in
+            ledger_job = f"api_{api_etag(submissions, '', '', office)}"
+            cached = build_api_response(submissions, is_batch, output_format, shard_by, timer, office,
+                                        get_voucher_ledger(office), ledger_job)
+        except JobAlreadyIssued:
+            # The same input is being issued by another request right now
+            timer.finish(ok=False)
+            return jsonify(error='The same receipts are being generated, please try again shortly'), \
+                409, {'Retry-After': '2'}
+        except ValueError as e:
+            timer.finish(ok=False)
+            return jsonify(error=str(e)), 400
+        except Exception as e:
+            timer.finish(ok=False)
+            return jsonify(error=f'Error processing request: {str(e)}'), 500
+        finally:
+            slot.release()
+        timer.finish()
+        
+        office.results.put(etag, cached)
+    
+    body, mimetype = cached
+    if mimetype == MIMETYPES['.xlsx']:
+        headers['Content-Disposition'] = 'attachment; filename=cash_receipts.xlsx'
+    return Response(body, mimetype=mimetype, headers=headers)
+
+@app.route('/ledger/search')
+def ledger_search():
+    """Search issued vouchers (needs the admin token, X-Receipts-Admin header).
+
+    Query parameters: office, date_from, date_to (YYYY-MM-DD), contractor,
+    route (prefix match), amount_min, amount_max, fy (e.g. 2025-26),
+    voucher_no, job, limit.
+    """
+    office = get_office(request.args.get('office'))
+    if office is None:
+        return jsonify(error=f"office must be one of {list(OFFICES)}"), 400
+    if not admin_authorized(office):
+        return jsonify(error=f'Ledger search needs the admin token ({ADMIN_HEADER} header)'), 403
+    ledger = get_voucher_ledger(office)
+    if ledger is None:
+        return jsonify(error='Voucher ledger is disabled'), 404
+    
+    args = request.args
+    try:
+        for key in ('date_from', 'date_to'):
+            if args.get(key):
+                datetime.strptime(args[key], '%Y-%m-%d')
+        int_args = {key: int(args[key]) for key in ('amount_min', 'amount_max', 'voucher_no', 'limit')
+                    if args.get(key)}
+    except ValueError:
+        return jsonify(error='Dates must be YYYY-MM-DD and amounts/numbers must be integers'), 400
+    
+    vouchers = ledger.search(
+        date_from=args.get('date_from'),
+        date_to=args.get('date_to'),
+        contractor=args.get('contractor'),
+        route=args.get('route'),
+        fy=args.get('fy'),
+        job=args.get('job'),
+        **int_args
+    )
+    return jsonify(count=len(vouchers), vouchers=vouchers)
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus scrape endpoint, only available when RECEIPTS_METRICS is set
+    if not receipt_metrics.ENABLED:
+        return 'Metrics disabled', 404
+    return receipt_metrics.REGISTRY.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/warmup')
+def warmup():
+    # Load heavy modules ahead of the first upload and report start-up timings
+    return jsonify(warm_up())
+
+# Optional warm-up in the background so the index page is served immediately
+if os.environ.get('RECEIPTS_WARMUP', '').lower() in ('1', 'true', 'yes', 'on'):
+    threading.Thread(target=warm_up, name='receipts-warmup', daemon=True).start()
+
+startup_timings['app'] = round((time.perf_counter() - _boot_started) * 1000, 2)
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=False, host='0.0.0.0', port=port)
@@ -0,0 +1,251 @@
+"""
+OFFICE PROFILES
+===============
+Per-office settings for offices sharing one Cash Receipts deployment.
+
+Each office has its own:
+- Name printed on the vouchers ("Received from SDE (Txn), Tumkur ...")
+- Contractor pools for PITS and OH Cable work
+- Grant and budget head printed in the voucher clauses
+- Optional official voucher template workbook (see receipt_template.py)
+- Output folder, voucher ledger and JSON API result cache
+- Optional admin token for the office's auditors (period bundles,
+  ledger search) on top of the deployment-wide RECEIPTS_ADMIN_TOKEN
+- Limit on receipt jobs running at once, so one office's year-end bulk
+  job cannot hold every worker; the limit holds across all worker
+  processes on the host (slots are lock files in data/locks/)
+- Separate limit on bundle downloads, so auditors fetching a quarter on
+  slow links do not keep the office from generating
+
+Usage:
+    offices = load_offices('offices.json')
+    office = offices['tumkur']
+    with office.job_slot():       # raises OfficeBusy when the office is at its limit
+        ...
+
+    slot = office.acquire_bundle()  # or hold a slot past the request
+    ...
+    slot.release()
+
+offices.json maps an office key to its settings (see offices.example.json).
+Missing settings fall back to the built-in default office.
+"""
+
+import json
+import os
+import re
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_KEY = 'default'
+
+# What the original Tumkur vouchers print
+DEFAULT_PAYER = "SDE (Txn), Tumkur"
+DEFAULT_GRANT = "Maintainnace Grant"
+DEFAULT_BUDGET_HEAD = "RM Cables / TMR/LABOUR/5020819"
+DEFAULT_CONTRACTORS = [
+    "Tilak G, 7th Cross, Veerasagara, Tumkur",
+    "K G Ravi Kaidala Tumkur",
+    "Narasimha Murthy, Kittadakuppe, Gubbi",
+    "Siddappa, Kaidala, Gulur Hobli, Tumkur"
+]
+
+# Receipt jobs one office may run at once, across all workers
+DEFAULT_MAX_JOBS = int(os.environ.get('RECEIPTS_MAX_JOBS_PER_OFFICE', 2))
+
+# Bundle downloads one office may stream at once, apart from its jobs
+DEFAULT_MAX_BUNDLES = int(os.environ.get('RECEIPTS_MAX_BUNDLES_PER_OFFICE', 2))
+
+# Slot lock files shared by the worker processes; must be on a local disk
+LOCK_FOLDER = os.environ.get('RECEIPTS_LOCK_FOLDER', os.path.join('data', 'locks'))
+
+# Results kept per office for the JSON API
+DEFAULT_CACHE_SIZE = 32
+
+# Office keys become folder and file names
+KEY_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,31}$')
+
+
+class OfficeBusy(Exception):
+    """Raised when an office already runs its maximum number of jobs"""
+
+
+class Slot:
+    """A held slot: an open, locked slot file (closing it frees the slot)"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.lock = threading.Lock()
+
+    def release(self):
+        # Safe to call twice: the fd number may already belong to another file
+        with self.lock:
+            if self.fd is None:
+                return
+            fd, self.fd = self.fd, None
+        os.close(fd)
+
+
+class SlotFiles:
+    """A limit shared by every process and thread, as numbered lock files.
+
+    A slot is taken by locking its file without waiting. Locks belong to
+    the open file, so two threads of one worker compete like two workers,
+    and a worker that dies gives its slots back with its files.
+    """
+
+    def __init__(self, folder, name, limit):
+        self.folder = folder
+        self.name = name
+        self.limit = limit
+
+    def acquire(self):
+        """Lock a free slot file and return its Slot, None when all are taken"""
+        os.makedirs(self.folder, exist_ok=True)
+        for number in range(self.limit):
+            fd = os.open(os.path.join(self.folder, f'{self.name}_{number}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            except OSError:
+                os.close(fd)
+                continue
+            return Slot(fd)
+        return None
+
+
+class ResultCache:
+    """Small thread-safe LRU cache"""
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+class OfficeProfile:
+    """Settings and per-office state (job and bundle slots, result cache)"""
+
+    def __init__(self, key, name=None, payer=DEFAULT_PAYER, grant=DEFAULT_GRANT,
+                 budget_heads=None, contractors_pits=None, contractors_oh_cable=None,
+                 max_concurrent_jobs=DEFAULT_MAX_JOBS, cache_size=DEFAULT_CACHE_SIZE, template=None,
+                 admin_token=None, max_concurrent_bundles=DEFAULT_MAX_BUNDLES, lock_folder=LOCK_FOLDER):
+        if not KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid office key {key!r}: use lowercase letters, digits, '-' and '_'")
+        self.key = key
+        self.name = name or payer
+        self.payer = payer
+        self.grant = grant
+        # Budget head per work type ("PITS Work", "OH Cable Work"), 'default' for the rest
+        self.budget_heads = {'default': DEFAULT_BUDGET_HEAD}
+        self.budget_heads.update(budget_heads or {})
+        self.contractors_pits = list(contractors_pits or DEFAULT_CONTRACTORS)
+        self.contractors_oh_cable = list(contractors_oh_cable or DEFAULT_CONTRACTORS)
+        # Path of the office's voucher template .xlsx, None for the built-in layout
+        self.template = template
+        # Lets an office's auditors read its ledger and bundles (not other offices')
+        self.admin_token = admin_token
+        self.max_concurrent_jobs = max(1, int(max_concurrent_jobs))
+        self.max_concurrent_bundles = max(1, int(max_concurrent_bundles))
+        self.results = ResultCache(cache_size)
+        self._jobs = SlotFiles(lock_folder, f'{key}_job', self.max_concurrent_jobs)
+        self._bundles = SlotFiles(lock_folder, f'{key}_bundle', self.max_concurrent_bundles)
+
+    @property
+    def is_default(self):
+        return self.key == DEFAULT_KEY
+
+    def budget_head(self, work_type):
+        return self.budget_heads.get(work_type, self.budget_heads['default'])
+
+    def contractor_pool(self, is_pits):
+        return self.contractors_pits if is_pits else self.contractors_oh_cable
+
+    def output_folder(self, base):
+        """Folder for this office's generated files (the default office uses base itself)"""
+        return base if self.is_default else os.path.join(base, self.key)
+
+    def ledger_path(self, base_path):
+        """Voucher ledger database for this office, so numbering runs per office"""
+        if self.is_default:
+            return base_path
+        root, ext = os.path.splitext(base_path)
+        return f'{root}_{self.key}{ext}'
+
+    def acquire_job(self):
+        """Take one of the office's receipt job slots, return it to release"""
+        return self._acquire(self._jobs, 'receipt job')
+
+    def acquire_bundle(self):
+        """Take one of the office's bundle download slots, return it to release"""
+        return self._acquire(self._bundles, 'bundle download')
+
+    def _acquire(self, slots, what):
+        # Fail straight away rather than queue: a waiting request would hold a worker too
+        slot = slots.acquire()
+        if slot is None:
+            raise OfficeBusy(f"{self.name} already has {slots.limit} {what}"
+                             f"{'s' if slots.limit != 1 else ''} running, please try again shortly")
+        return slot
+
+    def release_job(self, slot):
+        slot.release()
+
+    @contextmanager
+    def job_slot(self):
+        slot = self.acquire_job()
+        try:
+            yield self
+        finally:
+            self.release_job(slot)
+
+
+def load_offices(path=None, lock_folder=LOCK_FOLDER):
+    """Load office profiles from a JSON file, keyed by office key.
+
+    The built-in default office is always present unless the file
+    overrides it; a missing file gives just the default office.
+    """
+    offices = OrderedDict()
+    offices[DEFAULT_KEY] = OfficeProfile(DEFAULT_KEY, lock_folder=lock_folder)
+    if not path or not os.path.exists(path):
+        return offices
+
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f"{path}: expected an object mapping office keys to settings")
+
+    for key, settings in config.items():
+        contractors = settings.pop('contractors', None)
+        if contractors is not None:
+            settings.setdefault('contractors_pits', contractors)
+            settings.setdefault('contractors_oh_cable', contractors)
+        try:
+            offices[key] = OfficeProfile(key, lock_folder=lock_folder, **settings)
+        except TypeError as e:
+            raise ValueError(f"{path}: office {key!r}: {e}")
+    return offices
@@ -0,0 +1,171 @@
+"""
+OUTPUT FILES
+============
+Writing, serving and cleaning up generated files safely when several
+workers and threads handle uploads at the same time.
+
+Features:
+- Each job writes into its own work folder (output/.jobs/<job>/) and
+  its finished files are renamed into the output folder in one step, so
+  a download never sees a half-written workbook, PDF or CSV and a failed
+  job leaves nothing behind
+- Job names are reserved by creating that folder, so two uploads of the
+  same file can never get the same output names
+- Downloads open the file before sending it: a clean-up that removes it
+  afterwards cannot cut the download short
+- evict_old_outputs() removes finished files past the retention time
+  and the work folders of jobs whose worker died, never a running job's
+  files; it is safe to run from every worker and from cron at once
+
+Usage:
+    job = reserve_job('output', 'Dec -25_cash_receipt_')
+    try:
+        wb.save(job.path('Dec -25_cash_receipt_1a2b3c4d.xlsx'))
+        job.publish_all()
+    finally:
+        job.discard()
+
+    python output_files.py --older-than 72     remove outputs older than 72 hours
+"""
+
+import argparse
+import os
+import shutil
+import time
+import uuid
+
+# Work folders of running jobs, inside each output folder
+JOBS_DIR = '.jobs'
+
+# A work folder untouched this long belongs to a job whose worker died
+STALE_JOB_SECONDS = 6 * 3600
+
+# Tries before giving up on finding a free job name
+RESERVE_ATTEMPTS = 10
+
+
+class OutputJob:
+    """Work folder of one job and the output folder its files are published to"""
+
+    def __init__(self, name, folder, work_dir):
+        self.name = name
+        self.folder = folder
+        self.work_dir = work_dir
+
+    def path(self, filename):
+        """Where to write a file while the job runs"""
+        return os.path.join(self.work_dir, filename)
+
+    def publish(self, filename):
+        # Same filesystem, so the rename is atomic: readers see the old name or the whole file
+        os.replace(self.path(filename), os.path.join(self.folder, filename))
+
+    def publish_all(self):
+        """Move every finished file into the output folder, return their names"""
+        names = sorted(os.listdir(self.work_dir))
+        for filename in names:
+            self.publish(filename)
+        return names
+
+    def discard(self):
+        """Remove the work folder and anything not published"""
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def reserve_job(folder, prefix, suffixes=()):
+    """Reserve a unique job name (prefix + 8 hex characters) in an output folder.
+
+    The name is taken by creating its work folder, which only one job can
+    do; names whose files (name + suffix) are already in the folder are
+    skipped too.
+    """
+    jobs_dir = os.path.join(folder, JOBS_DIR)
+    os.makedirs(jobs_dir, exist_ok=True)
+    for _ in range(RESERVE_ATTEMPTS):
+        name = f'{prefix}{uuid.uuid4().hex[:8]}'
+        if any(os.path.exists(os.path.join(folder, name + suffix)) for suffix in suffixes):
+            continue
+        work_dir = os.path.join(jobs_dir, name)
+        try:
+            os.mkdir(work_dir)
+        except FileExistsError:
+            continue
+        return OutputJob(name, folder, work_dir)
+    raise RuntimeError(f'Could not find a free job name for {prefix!r} in {folder}')
+
+
+def open_output(path):
+    """Open a generated file for sending, None if it is not there (any more)"""
+    try:
+        return open(path, 'rb')
+    except (FileNotFoundError, IsADirectoryError):
+        return None
+
+
+def _last_change(path):
+    # Newest mtime of a work folder and its files (a long save touches only its file)
+    newest = os.path.getmtime(path)
+    for entry in os.scandir(path):
+        try:
+            newest = max(newest, entry.stat().st_mtime)
+        except FileNotFoundError:
+            pass
+    return newest
+
+
+def _remove(path, remove):
+    try:
+        remove(path)
+    except FileNotFoundError:
+        return False  # Another worker was first
+    except OSError:
+        return False  # Open elsewhere (Windows), try again next time
+    return True
+
+
+def evict_old_outputs(folder, max_age_seconds=None, now=None):
+    """Remove old outputs from an output folder and its office subfolders.
+
+    Files older than max_age_seconds are removed (none when it is None);
+    work folders of dead jobs always are. Returns the removed paths.
+    """
+    now = time.time() if now is None else now
+    removed = []
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return removed
+    for entry in entries:
+        try:
+            if entry.name == JOBS_DIR and entry.is_dir():
+                for job_dir in os.scandir(entry.path):
+                    if job_dir.is_dir() and now - _last_change(job_dir.path) > STALE_JOB_SECONDS:
+                        if _remove(job_dir.path, shutil.rmtree):
+                            removed.append(job_dir.path)
+            elif entry.is_dir():
+                # Office folder (output/<office>/)
+                removed += evict_old_outputs(entry.path, max_age_seconds, now)
+            elif max_age_seconds is not None and not entry.name.startswith('.'):
+                if now - entry.stat().st_mtime > max_age_seconds and _remove(entry.path, os.remove):
+                    removed.append(entry.path)
+        except FileNotFoundError:
+            continue
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove old generated receipt files')
+    parser.add_argument('--older-than', type=float, metavar='HOURS',
+                        help='remove outputs older than this (default: only dead job folders)')
+    parser.add_argument('--folder', default='output', help="the app's output folder (default: output)")
+    args = parser.parse_args()
+
+    max_age = args.older_than * 3600 if args.older_than is not None else None
+    removed = evict_old_outputs(args.folder, max_age)
+    for path in removed:
+        print(f'removed {path}')
+    print(f'{len(removed)} removed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""
+RECEIPT BUNDLES
+===============
+One zip of many generated books (workbooks, PDFs, totals CSVs), e.g. all
+receipts of a quarter for the auditors.
+
+Features:
+- The zip is streamed as it is built: a member is sent as soon as it is
+  ready, nothing waits for the whole archive
+- Members are checksummed and compressed by a pool of worker threads
+  (zlib releases the GIL) while earlier members are being sent
+- Memory stays bounded however big the bundle is: files are read in
+  chunks, only a few members are in flight at a time and compressed data
+  spills to a temporary file past SPOOL_MEMORY
+- Workbooks are stored as they are (an .xlsx is already a deflated zip);
+  other files are deflated unless that does not make them smaller
+- ZIP64 records are written when a bundle passes 4 GB or 65535 files
+
+Usage:
+    python receipt_bundle.py -o Q3.zip output/*.xlsx output/*.pdf
+    python receipt_bundle.py --date-from 2025-10-01 --date-to 2025-12-31 -o Q3.zip
+    python receipt_bundle.py --office gubbi --fy 2025-26 -o gubbi_2025-26.zip
+
+    In the app:
+    for chunk in stream_zip(members):   # members: [(path, name in zip)]
+        ...
+"""
+
+import argparse
+import os
+import struct
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Generated files that belong to a job, by name after the job name
+JOB_FILE_SUFFIXES = ('.xlsx', '.pdf', '_totals.csv')
+
+# Already compressed, deflating them again only costs time
+STORED_EXTENSIONS = {'.xlsx', '.zip', '.gz', '.br', '.png', '.jpg', '.jpeg'}
+
+# Compressing workers; members in flight are limited to twice this
+DEFAULT_WORKERS = max(1, int(os.environ.get('RECEIPTS_BUNDLE_WORKERS', min(4, os.cpu_count() or 1))))
+
+CHUNK_SIZE = 256 * 1024
+# Compressed data kept in memory per member before it goes to a temporary file
+SPOOL_MEMORY = 1024 * 1024
+COMPRESS_LEVEL = 6
+
+# Sizes, offsets and counts from these up go in ZIP64 records; the classic
+# fields then hold the marker values
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_COUNT_MARKER = 0xFFFF
+UTF8_FLAG = 0x800
+
+
+def job_files(folder, jobs):
+    """(path, name) of the generated files of each job found in folder"""
+    members = []
+    for job in jobs:
+        for suffix in JOB_FILE_SUFFIXES:
+            filename = f'{job}{suffix}'
+            path = os.path.join(folder, filename)
+            if os.path.isfile(path):
+                members.append((path, filename))
+    return members
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+           ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def _read_chunks(f):
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def prepare_member(path, name):
+    """Checksum (and compress) one file, run in a worker.
+
+    Returns a dict with the zip fields and an open file holding the data
+    to send (the source itself when stored), or None if the file is gone.
+    The file is kept open so a later cleanup cannot take it away mid-bundle.
+    """
+    try:
+        source = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    try:
+        mtime = os.fstat(source.fileno()).st_mtime
+        crc = 0
+        size = 0
+        if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+            for chunk in _read_chunks(source):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+            source.seek(0)
+            return dict(name=name, mtime=mtime, crc=crc, size=size, compressed_size=size,
+                        method=0, data=source)
+
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY)
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+        for chunk in _read_chunks(source):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            spool.write(compressor.compress(chunk))
+        spool.write(compressor.flush())
+        compressed_size = spool.tell()
+        if compressed_size >= size:
+            # Did not shrink: send the file as it is
+            spool.close()
+            source.seek(0)
+            return dict(name=name, mtime=mtime, crc=crc, size=size, compressed_size=size,
+                        method=0, data=source)
+        source.close()
+        spool.seek(0)
+        return dict(name=name, mtime=mtime, crc=crc, size=size, compressed_size=compressed_size,
+                    method=8, data=spool)
+    except BaseException:
+        source.close()
+        raise
+
+
+def _local_header(member):
+    name = member['name'].encode('utf-8')
+    dos_time, dos_date = _dos_datetime(member['mtime'])
+    extra = b''
+    size, compressed_size = member['size'], member['compressed_size']
+    version = 20
+    if size >= ZIP64_LIMIT or compressed_size >= ZIP64_LIMIT:
+        extra = struct.pack('<HHQQ', 1, 16, size, compressed_size)
+        size = compressed_size = ZIP64_MARKER
+        version = 45
+    return struct.pack('<IHHHHHIIIHH', 0x04034b50, version, UTF8_FLAG, member['method'],
+                       dos_time, dos_date, member['crc'], compressed_size, size,
+                       len(name), len(extra)) + name + extra
+
+
+def _central_header(member, offset):
+    name = member['name'].encode('utf-8')
+    dos_time, dos_date = _dos_datetime(member['mtime'])
+    size, compressed_size = member['size'], member['compressed_size']
+    # ZIP64 extra holds only the fields that overflowed, in this order
+    zip64 = []
+    if size >= ZIP64_LIMIT:
+        zip64.append(size)
+        size = ZIP64_MARKER
+    if compressed_size >= ZIP64_LIMIT:
+        zip64.append(compressed_size)
+        compressed_size = ZIP64_MARKER
+    if offset >= ZIP64_LIMIT:
+        zip64.append(offset)
+        offset = ZIP64_MARKER
+    extra = struct.pack(f'<HH{len(zip64)}Q', 1, 8 * len(zip64), *zip64) if zip64 else b''
+    version = 45 if zip64 else 20
+    return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, UTF8_FLAG,
+                       member['method'], dos_time, dos_date, member['crc'], compressed_size, size,
+                       len(name), len(extra), 0, 0, 0, 0o644 << 16, offset) + name + extra
+
+
+def _end_records(entries, directory_offset, directory_size):
+    records = b''
+    if (entries >= ZIP_FILECOUNT_LIMIT or directory_offset >= ZIP64_LIMIT
+            or directory_size >= ZIP64_LIMIT):
+        zip64_end_offset = directory_offset + directory_size
+        records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, entries, entries,
+                               directory_size, directory_offset)
+        records += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+        entries = min(entries, ZIP64_COUNT_MARKER)
+        directory_offset = min(directory_offset, ZIP64_MARKER)
+        directory_size = min(directory_size, ZIP64_MARKER)
+    return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, entries, entries,
+                                 directory_size, directory_offset, 0)
+
+
+def stream_zip(members, workers=DEFAULT_WORKERS):
+    """Yield a zip archive of (path, name) members chunk by chunk.
+
+    Files that disappear before they are read are left out.
+    """
+    members = list(members)
+    directory = []
+    offset = 0
+    pending = deque()
+    next_member = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='receipts-bundle') as pool:
+        try:
+            while pending or next_member < len(members):
+                # Keep the workers busy, but only a bounded number of members ahead
+                while next_member < len(members) and len(pending) < 2 * workers:
+                    pending.append(pool.submit(prepare_member, *members[next_member]))
+                    next_member += 1
+
+                member = pending.popleft().result()
+                if member is None:
+                    continue
+                with member['data'] as data:
+                    header = _local_header(member)
+                    yield header
+                    for chunk in _read_chunks(data):
+                        yield chunk
+                directory.append(_central_header(member, offset))
+                offset += len(header) + member['compressed_size']
+
+            directory_size = sum(len(entry) for entry in directory)
+            for entry in directory:
+                yield entry
+            yield _end_records(len(directory), offset, directory_size)
+        finally:
+            # Client went away: drop what is queued and close what is open
+            for future in pending:
+                if future.cancel():
+                    continue
+                try:
+                    member = future.result()
+                except Exception:
+                    continue
+                if member is not None:
+                    member['data'].close()
+
+
+def write_zip(members, path, workers=DEFAULT_WORKERS):
+    """Write a bundle to a file (renamed into place when complete), return its size"""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    size = 0
+    try:
+        with open(tmp, 'wb') as f:
+            for chunk in stream_zip(members, workers):
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bundle generated receipt books into one zip')
+    parser.add_argument('files', nargs='*', help='workbooks, PDFs or CSVs to include')
+    parser.add_argument('--office', default='default', help='office whose books to bundle (default: default)')
+    parser.add_argument('--date-from', help='include jobs with vouchers on or after YYYY-MM-DD')
+    parser.add_argument('--date-to', help='include jobs with vouchers on or before YYYY-MM-DD')
+    parser.add_argument('--fy', help='include jobs with vouchers in a financial year, e.g. 2025-26')
+    parser.add_argument('--output-folder', default='output', help="the app's output folder (default: output)")
+    parser.add_argument('--ledger', default=os.environ.get('RECEIPTS_LEDGER', os.path.join('data', 'voucher_ledger.db')),
+                        help='voucher ledger used to find the jobs (default: data/voucher_ledger.db)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='compressing threads')
+    parser.add_argument('-o', '--output', default='receipts_bundle.zip', help='zip file to write')
+    args = parser.parse_args()
+
+    members = [(path, os.path.basename(path)) for path in args.files]
+    if args.date_from or args.date_to or args.fy:
+        from office_profiles import load_offices
+        from voucher_ledger import VoucherLedger
+        offices = load_offices(os.environ.get('RECEIPTS_OFFICES', 'offices.json'))
+        if args.office not in offices:
+            parser.error(f'office must be one of {list(offices)}')
+        office = offices[args.office]
+        ledger_path = office.ledger_path(args.ledger)
+        if not os.path.exists(ledger_path):
+            parser.error(f'no voucher ledger at {ledger_path}')
+        jobs = VoucherLedger(ledger_path).jobs(date_from=args.date_from, date_to=args.date_to, fy=args.fy)
+        found = job_files(office.output_folder(args.output_folder), [job['job'] for job in jobs])
+        if not found:
+            parser.error(f'{len(jobs)} jobs in that period, but none of their files are in '
+                         f'{office.output_folder(args.output_folder)}')
+        members += found
+    if not members:
+        parser.error('nothing to bundle: give files and/or --date-from/--date-to/--fy')
+
+    size = write_zip(members, args.output, max(1, args.workers))
+    print(f'{len(members)} files, {size / 1024 / 1024:.1f} MB written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,421 @@
+"""
+GOLDEN OUTPUT CHECKS
+====================
+Confirms the receipt generator still produces the same books, so the
+workbook and PDF writers can be optimised safely.
+
+Features:
+- Canonical form of a workbook: cell values, styles (font, alignment,
+  border, fill, number format), merged ranges, row heights and column
+  widths, and print layout, each hashed into a section digest
+- Golden cases (golden_digests.json): an input file and options,
+  generated under a fixed contractor seed, must give the recorded
+  digests exactly (workbook sections and PDF bytes)
+- Golden workbooks (Dec -25_cash_receipt.xlsx): today's output for the
+  same input must match cell for cell, with the randomly drawn
+  contractors masked since that book was made with another seed
+- Property checks for number_to_words: every amount up to 10 lakh and a
+  sample up to 999 crore must read back as the same number, with only
+  known words in the right order
+
+Usage:
+    python receipt_golden.py              run every check (exit status 1 on a difference)
+    python receipt_golden.py --record     re-record golden_digests.json after an intended change
+    python receipt_golden.py --digest book.xlsx other.xlsx     print or compare workbook digests
+"""
+
+import argparse
+import difflib
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+from datetime import date, datetime, time
+
+GOLDEN_DIGESTS = 'golden_digests.json'
+
+# Seed for random contractor choice in golden cases
+GOLDEN_SEED = 2026
+
+SECTIONS = ('cells', 'styles', 'merges', 'dimensions', 'layout')
+
+# The golden workbook predates the print layout (page setup, breaks)
+GOLDEN_WORKBOOK_SECTIONS = ('cells', 'styles', 'merges', 'dimensions')
+
+# It also leaves the title rows to auto-size; the generator now sets the
+# height they auto-size to, which prints the same
+AUTO_SIZED_ROW_HEIGHTS = ('18.75',)
+
+# Golden workbooks and the TY Adv Appl file they were generated from
+GOLDEN_WORKBOOKS = [
+    ('Dec -25.xlsx', 'Dec -25_cash_receipt.xlsx'),
+]
+
+# Cases recorded by --record: (name, input file, generate_receipts options)
+GOLDEN_CASES = [
+    ('dec-25', 'Dec -25.xlsx', {}),
+    ('dec-25-by-date', 'Dec -25.xlsx', {'shard_by': 'date'}),
+    ('dec-25-by-contractor', 'Dec -25.xlsx', {'shard_by': 'contractor', 'analytics': True}),
+]
+
+CONTRACTOR_MASK = '<contractor>'
+
+# number_to_words: every amount below EXHAUSTIVE_LIMIT, then samples up to MAX_WORDS_AMOUNT
+EXHAUSTIVE_LIMIT = 1000000
+MAX_WORDS_AMOUNT = 9999999999  # 999 crore 99 lakh 99 thousand 999
+WORDS_SAMPLES = 200000
+
+# Lines of difference shown per section
+DIFF_LINES = 20
+
+
+def _value(value):
+    # Type-tagged so 1300 and '1300' differ
+    if isinstance(value, (datetime, date, time)):
+        return f'{type(value).__name__}:{value.isoformat()}'
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return f'{type(value).__name__}:{value!r}'
+
+
+def _color(color):
+    if color is None:
+        return None
+    return color.rgb if color.type == 'rgb' else f'{color.type}:{color.value}'
+
+
+def _style(cell):
+    font, align, border, fill = cell.font, cell.alignment, cell.border, cell.fill
+    sides = tuple((side.style, _color(side.color))
+                  for side in (border.left, border.right, border.top, border.bottom))
+    return repr((
+        (font.name, font.sz, font.b, font.i, font.u, font.strike, _color(font.color)),
+        (align.horizontal, align.vertical, align.wrap_text, align.shrink_to_fit, align.indent,
+         align.text_rotation),
+        sides,
+        (fill.fill_type, _color(fill.fgColor)) if fill.fill_type else None,
+        cell.number_format,
+    ))
+
+
+def canonical_lines(wb, mask=()):
+    """Canonical text of a workbook, {section: [lines]}.
+
+    Strings in mask are replaced in cell text by CONTRACTOR_MASK.
+    """
+    from openpyxl.cell.cell import MergedCell
+
+    lines = {section: [] for section in SECTIONS}
+    lines['cells'].append(f'sheets {wb.sheetnames!r}')
+    for ws in wb.worksheets:
+        title = ws.title
+        for row in ws.iter_rows():
+            for cell in row:
+                value = None if isinstance(cell, MergedCell) else cell.value
+                if value is not None:
+                    if isinstance(value, str):
+                        for text in mask:
+                            value = value.replace(text, CONTRACTOR_MASK)
+                    lines['cells'].append(f'{title}!{cell.coordinate} {_value(value)}')
+                if value is not None or cell.has_style:
+                    lines['styles'].append(f'{title}!{cell.coordinate} {_style(cell)}')
+        for merged in sorted(ws.merged_cells.ranges, key=lambda r: (r.min_row, r.min_col, r.max_row, r.max_col)):
+            lines['merges'].append(f'{title}!{merged.coord}')
+        for row, dim in sorted(ws.row_dimensions.items()):
+            if dim.height is not None:
+                lines['dimensions'].append(f'{title}!row {row} {dim.height}')
+        for letter, dim in sorted(ws.column_dimensions.items()):
+            if dim.width:
+                lines['dimensions'].append(f'{title}!column {letter} {dim.width}')
+        setup, margins = ws.page_setup, ws.page_margins
+        lines['layout'] += [
+            f'{title}!print_area {ws.print_area}',
+            f'{title}!print_title_rows {ws.print_title_rows}',
+            f'{title}!page_setup {(setup.orientation, setup.paperSize, setup.scale, setup.fitToWidth, setup.fitToHeight)}',
+            f'{title}!fit_to_page {ws.sheet_properties.pageSetUpPr.fitToPage if ws.sheet_properties.pageSetUpPr else None}',
+            f'{title}!margins {(margins.left, margins.right, margins.top, margins.bottom, margins.header, margins.footer)}',
+            f'{title}!row_breaks {[brk.id for brk in ws.row_breaks.brk]}',
+            f'{title}!column_breaks {[brk.id for brk in ws.col_breaks.brk]}',
+            f'{title}!footer {ws.oddFooter.center.text!r}',
+            f'{title}!freeze_panes {ws.freeze_panes}',
+        ]
+    return lines
+
+
+def digest_lines(lines, sections=SECTIONS):
+    return {section: hashlib.sha256('\n'.join(lines[section]).encode('utf-8')).hexdigest()
+            for section in sections}
+
+
+def load_saved(wb_or_path):
+    """Workbook as it reads back from disk (a workbook in memory is saved first)"""
+    import openpyxl
+    if isinstance(wb_or_path, str):
+        return openpyxl.load_workbook(wb_or_path)
+    buffer = io.BytesIO()
+    wb_or_path.save(buffer)
+    buffer.seek(0)
+    return openpyxl.load_workbook(buffer)
+
+
+def workbook_digest(wb_or_path, sections=SECTIONS, mask=()):
+    """Section digests of a workbook or .xlsx path, {section: sha256}"""
+    return digest_lines(canonical_lines(load_saved(wb_or_path), mask), sections)
+
+
+def describe_differences(expected, actual, sections=SECTIONS):
+    """Readable differences between two canonical forms, one block per section"""
+    report = []
+    for section in sections:
+        if expected[section] == actual[section]:
+            continue
+        diff = list(difflib.unified_diff(expected[section], actual[section], 'expected', 'actual',
+                                         lineterm='', n=0))
+        shown = [line for line in diff[2:] if not line.startswith('@@')]
+        report.append(f'{section}: {len(shown)} lines differ')
+        report += [f'    {line}' for line in shown[:DIFF_LINES]]
+        if len(shown) > DIFF_LINES:
+            report.append(f'    ... {len(shown) - DIFF_LINES} more')
+    return report
+
+
+def generate_seeded(input_file, seed=GOLDEN_SEED, **options):
+    """generate_receipts() with a fixed contractor seed, numbered from 1 (no ledger).
+
+    Returns (workbook, records). The global random state is put back afterwards.
+    """
+    from app import generate_receipts
+
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        wb, error, _count, records = generate_receipts(input_file, **options)
+    finally:
+        random.setstate(state)
+    if error:
+        raise ValueError(f'{input_file}: {error}')
+    return wb, records
+
+
+def pdf_digest(records):
+    from receipt_pdf import write_receipts_pdf
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'receipts.pdf')
+        write_receipts_pdf(records, path)
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+
+def run_case(input_file, options):
+    wb, records = generate_seeded(input_file, **options)
+    digests = workbook_digest(wb)
+    digests['pdf'] = pdf_digest(records)
+    return digests
+
+
+def record_cases(path=GOLDEN_DIGESTS):
+    cases = {}
+    for name, input_file, options in GOLDEN_CASES:
+        cases[name] = {'input': input_file, 'seed': GOLDEN_SEED, 'options': options,
+                       'digests': run_case(input_file, options)}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(cases, f, indent=2)
+        f.write('\n')
+    return cases
+
+
+def check_cases(path=GOLDEN_DIGESTS):
+    """Compare the recorded cases with what the generator makes now, return failures"""
+    with open(path, encoding='utf-8') as f:
+        cases = json.load(f)
+    failures = []
+    for name, case in cases.items():
+        wb, records = generate_seeded(case['input'], case['seed'], **case['options'])
+        actual = workbook_digest(wb)
+        actual['pdf'] = pdf_digest(records)
+        changed = [key for key, digest in case['digests'].items() if actual.get(key) != digest]
+        if changed:
+            failures.append(f"{name}: {', '.join(changed)} changed")
+    return failures
+
+
+def contractor_names():
+    from app import OFFICES
+
+    names = set()
+    for office in OFFICES.values():
+        names.update(office.contractors_pits)
+        names.update(office.contractors_oh_cable)
+    # Longest first so a name inside another is not masked half way
+    return sorted(names, key=len, reverse=True)
+
+
+def check_golden_workbooks():
+    """Compare generated books with the golden workbooks, return failures"""
+    failures = []
+    mask = contractor_names()
+    for input_file, golden_file in GOLDEN_WORKBOOKS:
+        wb, _records = generate_seeded(input_file)
+        expected = canonical_lines(load_saved(golden_file), mask)
+        actual = canonical_lines(load_saved(wb), mask)
+        sized_rows = {line.rsplit(' ', 1)[0] for line in expected['dimensions']}
+        actual['dimensions'] = [line for line in actual['dimensions']
+                                if line.rsplit(' ', 1)[0] in sized_rows
+                                or line.rsplit(' ', 1)[1] not in AUTO_SIZED_ROW_HEIGHTS]
+        differences = describe_differences(expected, actual, GOLDEN_WORKBOOK_SECTIONS)
+        if differences:
+            failures.append(f'{golden_file} differs from the output for {input_file}:')
+            failures += differences
+    return failures
+
+
+# Words number_to_words may use, and what each one is worth
+UNIT_WORDS = {word: value for value, word in enumerate(
+    ["Zero", "One", "Two", "Three", "Four", "Five", "Six", "Seven", "Eight", "Nine", "Ten",
+     "Eleven", "Twelve", "Thirteen", "Fourteen", "Fifteen", "Sixteen", "Seventeen",
+     "Eighteen", "Nineteen"])}
+TENS_WORDS = {"Twenty": 20, "Thirty": 30, "Forty": 40, "Fifty": 50, "Sixty": 60,
+              "Seventy": 70, "Eighty": 80, "Ninety": 90}
+SCALE_WORDS = {"Crore": 10000000, "Lakh": 100000, "Thousand": 1000}
+
+
+def words_to_number(words):
+    """Read number_to_words output back strictly; ValueError when it is malformed.
+
+    Each group (crore, lakh, thousand, rest) must be 1-999 written the
+    usual way and the groups must come largest first, at most once each.
+    """
+    if words == "Zero":
+        return 0
+    if not words or words != ' '.join(words.split()):
+        raise ValueError(f'bad spacing in {words!r}')
+
+    total = 0
+    group = []
+    last_scale = None
+    for word in words.split() + [None]:
+        if word is not None and word not in SCALE_WORDS:
+            group.append(word)
+            continue
+        if not group:
+            if word is None and last_scale is not None:
+                break  # Nothing after the last scale word, e.g. "Two Thousand"
+            raise ValueError(f'{word} without a number in {words!r}')
+        value = _words_below_thousand(group, words)
+        if word is None:
+            total += value
+        else:
+            if last_scale is not None and SCALE_WORDS[word] >= SCALE_WORDS[last_scale]:
+                raise ValueError(f'{word} after {last_scale} in {words!r}')
+            if word != "Crore" and value > 99:
+                raise ValueError(f'{value} {word} in {words!r}')
+            total += value * SCALE_WORDS[word]
+            last_scale = word
+        group = []
+    return total
+
+
+def _words_below_thousand(group, words):
+    value = 0
+    rest = list(group)
+    if len(rest) >= 2 and rest[1] == "Hundred":
+        hundreds = UNIT_WORDS.get(rest[0], 0)
+        if not 1 <= hundreds <= 9:
+            raise ValueError(f'bad hundreds in {words!r}')
+        value += hundreds * 100
+        rest = rest[2:]
+    if rest and rest[0] in TENS_WORDS:
+        value += TENS_WORDS[rest[0]]
+        rest = rest[1:]
+        if rest:
+            unit = UNIT_WORDS.get(rest[0], 0)
+            if not 1 <= unit <= 9:
+                raise ValueError(f'bad unit after tens in {words!r}')
+            value += unit
+            rest = rest[1:]
+    elif rest:
+        unit = UNIT_WORDS.get(rest[0], 0)
+        if not 1 <= unit <= 19:
+            raise ValueError(f'unknown word {rest[0]!r} in {words!r}')
+        value += unit
+        rest = rest[1:]
+    if rest or value == 0:
+        raise ValueError(f'unexpected {" ".join(rest) or "empty group"} in {words!r}')
+    return value
+
+
+def check_number_to_words(seed=GOLDEN_SEED):
+    """Every amount below EXHAUSTIVE_LIMIT and a sample up to MAX_WORDS_AMOUNT must read back"""
+    from app import number_to_words
+
+    rng = random.Random(seed)
+    amounts = list(range(EXHAUSTIVE_LIMIT))
+    amounts += [rng.randint(EXHAUSTIVE_LIMIT, MAX_WORDS_AMOUNT) for _ in range(WORDS_SAMPLES)]
+    # Group boundaries are where mistakes hide
+    for scale in (100, 1000, 100000, 10000000):
+        for multiple in (1, 9, 10, 11, 19, 20, 99):
+            for delta in (-1, 0, 1):
+                if 0 <= scale * multiple + delta <= MAX_WORDS_AMOUNT:
+                    amounts.append(scale * multiple + delta)
+    amounts.append(MAX_WORDS_AMOUNT)
+
+    failures = []
+    for amount in amounts:
+        words = number_to_words(amount)
+        try:
+            read_back = words_to_number(words)
+        except ValueError as e:
+            failures.append(f'number_to_words({amount}): {e}')
+        else:
+            if read_back != amount:
+                failures.append(f'number_to_words({amount}) = {words!r} reads as {read_back}')
+        if len(failures) >= DIFF_LINES:
+            failures.append('... stopped after the first differences')
+            break
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check generated receipts against the golden output')
+    parser.add_argument('--record', action='store_true', help=f're-record {GOLDEN_DIGESTS}')
+    parser.add_argument('--digest', nargs='+', metavar='XLSX',
+                        help='print the section digests of workbooks (and compare two)')
+    parser.add_argument('--skip-words', action='store_true', help='skip the number_to_words checks')
+    args = parser.parse_args()
+
+    if args.digest:
+        forms = [canonical_lines(load_saved(path)) for path in args.digest]
+        for path, lines in zip(args.digest, forms):
+            print(path)
+            for section, digest in digest_lines(lines).items():
+                print(f'    {section:<11} {digest}')
+        if len(forms) == 2:
+            differences = describe_differences(*forms)
+            print('\n'.join(differences) or 'identical')
+            return 1 if differences else 0
+        return 0
+
+    if args.record:
+        cases = record_cases()
+        print(f'{len(cases)} cases recorded in {GOLDEN_DIGESTS}')
+        return 0
+
+    checks = [('golden cases', check_cases), ('golden workbooks', check_golden_workbooks)]
+    if not args.skip_words:
+        checks.append(('number_to_words', check_number_to_words))
+    failed = False
+    for name, check in checks:
+        failures = check()
+        print(f"{name}: {'FAILED' if failures else 'ok'}")
+        for line in failures:
+            print(f'    {line}')
+        failed = failed or bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,342 @@
+"""
+RECEIPT GENERATION METRICS
+==========================
+Lightweight per-stage timing for the /generate pipeline.
+
+Stages recorded:
+- parse       (reading the TY Adv Appl sheet)
+- validate    (duplicate and anomaly checks)
+- contractor  (contractor assignment)
+- describe    (description and amount-in-words text)
+- ledger      (voucher numbering in the ledger)
+- render      (drawing voucher cells into the workbook)
+- save        (wb_output.save)
+- pdf         (PDF output, when requested)
+- report      (totals CSV, when requested)
+- session     (writing preview data into the session)
+
+Metrics are exposed in Prometheus text format on /metrics and every job
+also writes one structured (JSON) log line.
+
+Each worker process saves its totals to its own file in data/metrics/
+after every job, and /metrics adds up the files of all workers: whichever
+worker answers the scrape, the counters cover the whole deployment.
+
+Usage:
+    Set RECEIPTS_METRICS=1 to enable. When disabled every hook is a no-op
+    and /metrics returns 404. RECEIPTS_METRICS_DIR moves the shared folder
+    (empty it to reset the counters).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+ENABLED = os.environ.get('RECEIPTS_METRICS', '').lower() in ('1', 'true', 'yes', 'on')
+
+# Every worker keeps its totals here so /metrics can add them up
+METRICS_DIR = os.environ.get('RECEIPTS_METRICS_DIR', os.path.join('data', 'metrics'))
+
+STAGES = ('parse', 'validate', 'contractor', 'describe', 'ledger', 'render', 'save', 'pdf', 'report', 'session')
+
+# Latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Size buckets for rows / receipts per job
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+logger = logging.getLogger('receipts.metrics')
+
+
+def peak_rss_bytes():
+    """Peak resident memory of this process, or None if unknown"""
+    if resource is None:
+        return None
+    # ru_maxrss is kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus style"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+    def to_dict(self):
+        return {'buckets': list(self.buckets), 'counts': self.counts, 'total': self.total, 'count': self.count}
+
+    def merge(self, saved):
+        """Add a histogram saved by another worker (skipped if its buckets differ)"""
+        if tuple(saved['buckets']) != tuple(self.buckets):
+            return
+        self.counts = [a + b for a, b in zip(self.counts, saved['counts'])]
+        self.total += saved['total']
+        self.count += saved['count']
+
+    def render(self, name, labels=''):
+        sep = ',' if labels else ''
+        lines = []
+        for upper, count in zip(self.buckets, self.counts):
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{upper}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {self.total:.6f}')
+        lines.append(f'{name}_count{suffix} {self.count}')
+        return lines
+
+
+def _process_alive(pid):
+    if os.name != 'posix':
+        return True  # os.kill(pid, 0) would end the process on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """Counters and histograms for receipt jobs of this process.
+
+    With a folder, the totals are saved there after every job and render()
+    adds up the saved totals of every worker.
+    """
+
+    def __init__(self, folder=None):
+        self.folder = folder
+        self.pid = None
+        self.path = None
+        self.lock = threading.Lock()
+        self.stage_seconds = {name: Histogram(LATENCY_BUCKETS) for name in STAGES}
+        self.stage_calls = {name: 0 for name in STAGES}
+        self.rows_per_job = Histogram(SIZE_BUCKETS)
+        self.receipts_per_job = Histogram(SIZE_BUCKETS)
+        self.jobs = {'ok': 0, 'error': 0}
+        self.rows_total = 0
+        self.receipts_total = 0
+
+    def record_job(self, stages, calls, rows, receipts, ok):
+        with self.lock:
+            for name, seconds in stages.items():
+                if name not in self.stage_seconds:
+                    self.stage_seconds[name] = Histogram(LATENCY_BUCKETS)
+                    self.stage_calls[name] = 0
+                self.stage_seconds[name].observe(seconds)
+                self.stage_calls[name] += calls.get(name, 0)
+            self.jobs['ok' if ok else 'error'] += 1
+            if ok:
+                self.rows_per_job.observe(rows)
+                self.receipts_per_job.observe(receipts)
+                self.rows_total += rows
+                self.receipts_total += receipts
+            if self.folder:
+                self._save()
+
+    def to_dict(self):
+        return {
+            'pid': os.getpid(),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'stage_seconds': {name: hist.to_dict() for name, hist in self.stage_seconds.items()},
+            'stage_calls': self.stage_calls,
+            'rows_per_job': self.rows_per_job.to_dict(),
+            'receipts_per_job': self.receipts_per_job.to_dict(),
+            'jobs': self.jobs,
+            'rows_total': self.rows_total,
+            'receipts_total': self.receipts_total,
+        }
+
+    def merge(self, saved):
+        """Add the totals saved by another worker"""
+        for name, hist in saved['stage_seconds'].items():
+            if name not in self.stage_seconds:
+                self.stage_seconds[name] = Histogram(LATENCY_BUCKETS)
+                self.stage_calls[name] = 0
+            self.stage_seconds[name].merge(hist)
+        for name, count in saved['stage_calls'].items():
+            self.stage_calls[name] = self.stage_calls.get(name, 0) + count
+        self.rows_per_job.merge(saved['rows_per_job'])
+        self.receipts_per_job.merge(saved['receipts_per_job'])
+        for outcome, count in saved['jobs'].items():
+            self.jobs[outcome] = self.jobs.get(outcome, 0) + count
+        self.rows_total += saved['rows_total']
+        self.receipts_total += saved['receipts_total']
+
+    def _save(self):
+        # One file per process (named when first used, so forked workers get their own)
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.path = os.path.join(self.folder, f'{self.pid}_{uuid.uuid4().hex[:8]}.json')
+            os.makedirs(self.folder, exist_ok=True)
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp, self.path)
+
+    def _saved_totals(self):
+        """Totals of the other workers (live or not) from the shared folder"""
+        try:
+            names = os.listdir(self.folder)
+        except FileNotFoundError:
+            return []
+        saved = []
+        for name in names:
+            path = os.path.join(self.folder, name)
+            if not name.endswith('.json') or path == self.path:
+                continue
+            try:
+                with open(path, encoding='utf-8') as f:
+                    saved.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # Being replaced or damaged: counted at the next scrape
+        return saved
+
+    def render(self):
+        """Render all metrics in Prometheus text exposition format"""
+        if not self.folder:
+            return self._render([(os.getpid(), peak_rss_bytes())])
+        saved = self._saved_totals()
+        total = MetricsRegistry()
+        with self.lock:
+            total.merge(self.to_dict())
+        for totals in saved:
+            total.merge(totals)
+        workers = [(os.getpid(), peak_rss_bytes())]
+        workers += [(totals['pid'], totals['peak_rss_bytes']) for totals in saved
+                    if totals['pid'] != os.getpid() and _process_alive(totals['pid'])]
+        return total._render(workers)
+
+    def _render(self, workers):
+        with self.lock:
+            lines = [
+                '# HELP receipts_jobs_total Receipt generation jobs by outcome',
+                '# TYPE receipts_jobs_total counter',
+            ]
+            for outcome, count in self.jobs.items():
+                lines.append(f'receipts_jobs_total{{outcome="{outcome}"}} {count}')
+
+            lines += [
+                '# HELP receipts_rows_total Source rows ingested',
+                '# TYPE receipts_rows_total counter',
+                f'receipts_rows_total {self.rows_total}',
+                '# HELP receipts_generated_total Receipts generated',
+                '# TYPE receipts_generated_total counter',
+                f'receipts_generated_total {self.receipts_total}',
+                '# HELP receipts_stage_calls_total Times each stage was entered',
+                '# TYPE receipts_stage_calls_total counter',
+            ]
+            for name, count in self.stage_calls.items():
+                lines.append(f'receipts_stage_calls_total{{stage="{name}"}} {count}')
+
+            lines += [
+                '# HELP receipts_stage_seconds Time spent per stage per job',
+                '# TYPE receipts_stage_seconds histogram',
+            ]
+            for name, hist in self.stage_seconds.items():
+                lines += hist.render('receipts_stage_seconds', f'stage="{name}"')
+
+            lines += [
+                '# HELP receipts_job_rows Source rows per job',
+                '# TYPE receipts_job_rows histogram',
+            ]
+            lines += self.rows_per_job.render('receipts_job_rows')
+            lines += [
+                '# HELP receipts_job_receipts Receipts per job',
+                '# TYPE receipts_job_receipts histogram',
+            ]
+            lines += self.receipts_per_job.render('receipts_job_receipts')
+
+        workers = [(pid, rss) for pid, rss in workers if rss is not None]
+        if workers:
+            lines += [
+                '# HELP receipts_process_peak_rss_bytes Peak resident memory of each live worker',
+                '# TYPE receipts_process_peak_rss_bytes gauge',
+            ]
+            for pid, rss in sorted(workers):
+                lines.append(f'receipts_process_peak_rss_bytes{{worker="{pid}"}} {rss}')
+        return '\n'.join(lines) + '\n'
+
+
+class JobTimer:
+    """Accumulates stage timings for one /generate job"""
+
+    def __init__(self, registry, job_name=''):
+        self.registry = registry
+        self.job_name = job_name
+        self.stages = {}
+        self.calls = {}
+        self.rows = 0
+        self.receipts = 0
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def record_counts(self, rows, receipts):
+        self.rows = rows
+        self.receipts = receipts
+
+    def finish(self, ok=True):
+        self.registry.record_job(self.stages, self.calls, self.rows, self.receipts, ok)
+        logger.info(json.dumps({
+            'event': 'receipts_job',
+            'job': self.job_name,
+            'ok': ok,
+            'rows': self.rows,
+            'receipts': self.receipts,
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'stages_ms': {k: round(v * 1000, 2) for k, v in self.stages.items()},
+            'peak_rss_bytes': peak_rss_bytes(),
+        }))
+
+
+class NullJobTimer:
+    """Stand-in used when metrics are disabled"""
+
+    _null = nullcontext()
+
+    def stage(self, name):
+        return self._null
+
+    def record_counts(self, rows, receipts):
+        pass
+
+    def finish(self, ok=True):
+        pass
+
+
+REGISTRY = MetricsRegistry(METRICS_DIR)
+NULL_TIMER = NullJobTimer()
+
+
+def start_job(job_name=''):
+    """Return a timer for one job (a no-op timer when metrics are disabled)"""
+    if not ENABLED:
+        return NULL_TIMER
+    return JobTimer(REGISTRY, job_name)
@@ -0,0 +1,319 @@
+"""
+CASH RECEIPTS PDF WRITER
+========================
+Writes receipt records straight to PDF without going through Excel.
+
+Features:
+- Same 12-row voucher layout as the Cash Receipts workbook
+  (title, date/voucher, received from, description, amount, words,
+  signatures, clauses)
+- Pure Python, uses only the built-in Helvetica fonts
+- Pages are written to the file as soon as they are full, so memory
+  stays flat however many vouchers are in the book
+
+Usage:
+    from receipt_pdf import write_receipts_pdf
+    write_receipts_pdf(records, 'output/receipts.pdf')
+"""
+
+import zlib
+
+from office_profiles import OfficeProfile, DEFAULT_KEY
+
+# A4 portrait in points
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 36
+
+# Column widths follow the workbook (A = 15, B-H = 12 characters)
+COLUMN_UNITS = [15, 12, 12, 12, 12, 12, 12, 12]
+COLUMN_LETTERS = 'ABCDEFGH'
+
+# Row heights in points (row 4 is the 75pt description row)
+ROW_HEIGHT = 14
+DESCRIPTION_HEIGHT = 75
+VOUCHER_GAP = 20
+VOUCHER_HEIGHT = 11 * ROW_HEIGHT + DESCRIPTION_HEIGHT
+
+FONT_SIZE = 9
+TITLE_FONT_SIZE = 14
+CELL_PADDING = 3
+
+# Helvetica character widths (1/1000 em) for ASCII 32-126
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+
+# Helvetica-Bold widths for the characters used in the title
+_HELVETICA_BOLD_WIDTHS = {
+    ' ': 278, 'A': 722, 'C': 722, 'E': 667, 'H': 722, 'I': 278,
+    'P': 667, 'R': 722, 'S': 667, 'T': 611,
+}
+
+
+def text_width(text, size, bold=False):
+    """Width of text in points for the built-in Helvetica fonts"""
+    total = 0
+    for ch in text:
+        if bold and ch in _HELVETICA_BOLD_WIDTHS:
+            total += _HELVETICA_BOLD_WIDTHS[ch]
+            continue
+        code = ord(ch)
+        total += _HELVETICA_WIDTHS[code - 32] if 32 <= code <= 126 else 556
+    return total * size / 1000
+
+
+def wrap_text(text, width, size):
+    """Greedy word wrap to the given width in points"""
+    lines = []
+    current = ''
+    for word in text.split():
+        candidate = f'{current} {word}' if current else word
+        if current and text_width(candidate, size) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+
+def _escape(text):
+    data = text.encode('latin-1', errors='replace').decode('latin-1')
+    return data.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+class _PageCanvas:
+    """Collects drawing operators for one page"""
+
+    def __init__(self):
+        self.ops = ['0.5 w']
+
+    def rect(self, x, y, w, h):
+        self.ops.append(f'{x:.2f} {y:.2f} {w:.2f} {h:.2f} re S')
+
+    def text(self, x, y, text, size, bold=False):
+        font = 'F2' if bold else 'F1'
+        self.ops.append(f'BT /{font} {size} Tf {x:.2f} {y:.2f} Td ({_escape(text)}) Tj ET')
+
+    def content(self):
+        return '\n'.join(self.ops).encode('latin-1')
+
+
+class ReceiptPdfWriter:
+    """Streams vouchers into a PDF file, one page at a time"""
+
+    # Object numbers reserved up front so pages can refer to them
+    CATALOG_ID = 1
+    PAGES_ID = 2
+    FONT_ID = 3
+    BOLD_FONT_ID = 4
+
+    def __init__(self, path, office=None):
+        # Office whose name, grant and budget head go on the vouchers
+        self.office = office or OfficeProfile(DEFAULT_KEY)
+        self.file = open(path, 'wb')
+        self.offsets = {}
+        self.next_id = 5
+        self.page_ids = []
+        self.canvas = None
+        self.slot = 0
+
+        usable = PAGE_HEIGHT - 2 * MARGIN
+        self.vouchers_per_page = max(1, (usable + VOUCHER_GAP) // (VOUCHER_HEIGHT + VOUCHER_GAP))
+
+        unit = (PAGE_WIDTH - 2 * MARGIN) / sum(COLUMN_UNITS)
+        self.column_x = {}
+        x = MARGIN
+        for letter, units in zip(COLUMN_LETTERS, COLUMN_UNITS):
+            self.column_x[letter] = (x, units * unit)
+            x += units * unit
+
+        self.file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._write_object(self.FONT_ID,
+                           b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+                           b'/Encoding /WinAnsiEncoding >>')
+        self._write_object(self.BOLD_FONT_ID,
+                           b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold '
+                           b'/Encoding /WinAnsiEncoding >>')
+
+    def _allocate(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id, body):
+        self.offsets[obj_id] = self.file.tell()
+        self.file.write(f'{obj_id} 0 obj\n'.encode('ascii'))
+        self.file.write(body)
+        self.file.write(b'\nendobj\n')
+
+    def _span(self, first, last):
+        x, _ = self.column_x[first]
+        last_x, last_w = self.column_x[last]
+        return x, last_x + last_w - x
+
+    def _cell(self, top, height, first, last, text='', align='left', valign='center',
+              size=FONT_SIZE, bold=False, wrap=False):
+        """Draw a bordered (possibly merged) cell and its text"""
+        x, w = self._span(first, last)
+        y = top - height
+        self.canvas.rect(x, y, w, height)
+        if not text:
+            return
+
+        inner = w - 2 * CELL_PADDING
+        if wrap:
+            lines = wrap_text(text, inner, size)
+            # Shrink long descriptions until they fit the row
+            while size > 5 and len(lines) * size * 1.2 > height - 2 * CELL_PADDING:
+                size -= 0.5
+                lines = wrap_text(text, inner, size)
+        else:
+            lines = [text]
+            while size > 5 and text_width(text, size, bold) > inner:
+                size -= 0.5
+
+        leading = size * 1.2
+        if valign == 'top':
+            baseline = top - CELL_PADDING - size
+        else:
+            baseline = y + (height - size) / 2 + size * 0.22
+
+        for line in lines:
+            line_w = text_width(line, size, bold)
+            if align == 'center':
+                tx = x + (w - line_w) / 2
+            elif align == 'right':
+                tx = x + w - CELL_PADDING - line_w
+            else:
+                tx = x + CELL_PADDING
+            self.canvas.text(tx, baseline, line, size, bold)
+            baseline -= leading
+
+    def add_receipt(self, receipt):
+        """Lay out one voucher, starting a new page when the current one is full"""
+        if self.canvas is None:
+            self.canvas = _PageCanvas()
+            self.slot = 0
+
+        top = PAGE_HEIGHT - MARGIN - self.slot * (VOUCHER_HEIGHT + VOUCHER_GAP)
+        amount = receipt['amount']
+        amount_words = receipt['amount_words']
+        cell = self._cell
+
+        # Row 1: CASH RECEIPT
+        cell(top, ROW_HEIGHT, 'A', 'H', 'CASH RECEIPT', 'center', size=TITLE_FONT_SIZE, bold=True)
+        top -= ROW_HEIGHT
+
+        # Row 2: Date and Voucher No
+        cell(top, ROW_HEIGHT, 'A', 'A', 'Date')
+        cell(top, ROW_HEIGHT, 'B', 'B', receipt['date'])
+        cell(top, ROW_HEIGHT, 'C', 'F')
+        cell(top, ROW_HEIGHT, 'G', 'G', 'Voucher No:', 'right')
+        cell(top, ROW_HEIGHT, 'H', 'H', str(receipt['voucher_no']), 'center')
+        top -= ROW_HEIGHT
+
+        # Row 3: Received from
+        cell(top, ROW_HEIGHT, 'A', 'H', f"Received from {self.office.payer}  Sum of Rupees {amount}/-")
+        top -= ROW_HEIGHT
+
+        # Row 4: Description
+        cell(top, DESCRIPTION_HEIGHT, 'A', 'H', receipt['description'], valign='top', wrap=True)
+        top -= DESCRIPTION_HEIGHT
+
+        # Row 5: RS and Amount
+        cell(top, ROW_HEIGHT, 'A', 'A', 'RS')
+        cell(top, ROW_HEIGHT, 'B', 'H', str(amount))
+        top -= ROW_HEIGHT
+
+        # Row 6: Amount in words + Signatures
+        cell(top, ROW_HEIGHT, 'A', 'D', f"Rupees {amount_words} only", 'center')
+        cell(top, ROW_HEIGHT, 'E', 'F', 'Signature of Payee', 'center')
+        cell(top, ROW_HEIGHT, 'G', 'H', 'Signature of witness', 'center')
+        top -= ROW_HEIGHT
+
+        # Rows 7-12: Standard clauses
+        for text in [
+            "1. Labour Engaged is Justified",
+            "2.Work is done satisfactorily",
+            f"3.Provision Exists in the estimate {self.office.grant}",
+            self.office.budget_head(receipt['work_type']),
+            f"Passed and Paid for Rs. {amount}/-",
+            f"(Rupees {amount_words.title()} only)"
+        ]:
+            cell(top, ROW_HEIGHT, 'A', 'H', text, 'center')
+            top -= ROW_HEIGHT
+
+        self.slot += 1
+        if self.slot >= self.vouchers_per_page:
+            self._flush_page()
+
+    def _flush_page(self):
+        """Write the current page to disk and drop it from memory"""
+        if self.canvas is None:
+            return
+        content = zlib.compress(self.canvas.content())
+        content_id = self._allocate()
+        self._write_object(content_id,
+                           f'<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n'.encode('ascii')
+                           + content + b'\nendstream')
+
+        page_id = self._allocate()
+        self._write_object(page_id, (
+            f'<< /Type /Page /Parent {self.PAGES_ID} 0 R '
+            f'/MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 {self.FONT_ID} 0 R /F2 {self.BOLD_FONT_ID} 0 R >> >> '
+            f'/Contents {content_id} 0 R >>'
+        ).encode('ascii'))
+        self.page_ids.append(page_id)
+        self.canvas = None
+
+    def close(self):
+        """Finish the last page and write the page tree, xref and trailer"""
+        self._flush_page()
+        if not self.page_ids:
+            # An empty PDF still needs one page to be valid
+            self.canvas = _PageCanvas()
+            self._flush_page()
+
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        self._write_object(self.PAGES_ID,
+                           f'<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>'.encode('ascii'))
+        self._write_object(self.CATALOG_ID,
+                           f'<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>'.encode('ascii'))
+
+        xref_offset = self.file.tell()
+        size = self.next_id
+        self.file.write(f'xref\n0 {size}\n'.encode('ascii'))
+        self.file.write(b'0000000000 65535 f \n')
+        for obj_id in range(1, size):
+            self.file.write(f'{self.offsets[obj_id]:010d} 00000 n \n'.encode('ascii'))
+        self.file.write((
+            f'trailer\n<< /Size {size} /Root {self.CATALOG_ID} 0 R >>\n'
+            f'startxref\n{xref_offset}\n%%EOF\n'
+        ).encode('ascii'))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+
+def write_receipts_pdf(records, path, office=None):
+    """Write receipt records to a PDF file, return the number of pages"""
+    with ReceiptPdfWriter(path, office) as writer:
+        for receipt in records:
+            writer.add_receipt(receipt)
+    return len(writer.page_ids)
@@ -0,0 +1,100 @@
+"""
+RECEIPT GENERATION PROFILING
+============================
+Opt-in cProfile / tracemalloc capture for a single /generate request.
+
+A profiled job writes three files next to its workbook in output/:
+- <job>.pstats             (cProfile data, open with pstats or snakeviz)
+- <job>_alloc.tracemalloc  (tracemalloc snapshot, load with Snapshot.load)
+- <job>_profile.txt        (readable summary of both)
+
+Usage:
+    RECEIPTS_PROFILE=1                 profile every /generate request
+    RECEIPTS_PROFILE_TOKEN=<secret>    profile requests that send the
+                                       header  X-Receipts-Profile: <secret>
+"""
+
+import hmac
+import io
+import os
+import threading
+
+ENABLED = os.environ.get('RECEIPTS_PROFILE', '').lower() in ('1', 'true', 'yes', 'on')
+PROFILE_TOKEN = os.environ.get('RECEIPTS_PROFILE_TOKEN', '')
+PROFILE_HEADER = 'X-Receipts-Profile'
+
+# Frames kept per allocation so lines inside generate_receipts show up
+TRACEMALLOC_FRAMES = 10
+
+# Number of entries written to the text summary
+SUMMARY_LIMIT = 40
+
+# tracemalloc is process wide, so only one profiled job runs at a time
+_profile_lock = threading.Lock()
+
+
+def profiling_requested(headers):
+    """Check whether this request should be profiled"""
+    if ENABLED:
+        return True
+    if not PROFILE_TOKEN:
+        return False
+    # Bytes: compare_digest refuses str with non-ASCII characters
+    return hmac.compare_digest(headers.get(PROFILE_HEADER, '').encode(), PROFILE_TOKEN.encode())
+
+
+def profile_call(func, *args, **kwargs):
+    """Run func under cProfile and tracemalloc.
+
+    Returns (result, profiler, snapshot).
+    """
+    # Imported here so normal start-up does not pay for them
+    import cProfile
+    import tracemalloc
+
+    with _profile_lock:
+        profiler = cProfile.Profile()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        try:
+            profiler.enable()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    snapshot.peak_bytes = peak
+    return result, profiler, snapshot
+
+
+def save_profile(profiler, snapshot, folder, job_name):
+    """Write profile artifacts for a job and return their file names"""
+    import pstats
+
+    pstats_name = f'{job_name}.pstats'
+    alloc_name = f'{job_name}_alloc.tracemalloc'
+    summary_name = f'{job_name}_profile.txt'
+
+    profiler.dump_stats(os.path.join(folder, pstats_name))
+    snapshot.dump(os.path.join(folder, alloc_name))
+
+    # Readable summary: slowest functions and biggest allocating lines
+    out = io.StringIO()
+    out.write(f'PROFILE: {job_name}\n')
+    out.write(f'Peak traced memory: {snapshot.peak_bytes / 1024:.1f} KiB\n\n')
+
+    out.write('=== Top functions by cumulative time ===\n')
+    stats = pstats.Stats(profiler, stream=out)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(SUMMARY_LIMIT)
+
+    out.write('\n=== Top allocating lines ===\n')
+    for stat in snapshot.statistics('lineno')[:SUMMARY_LIMIT]:
+        out.write(f'{stat}\n')
+
+    with open(os.path.join(folder, summary_name), 'w', encoding='utf-8') as f:
+        f.write(out.getvalue())
+
+    return [summary_name, pstats_name, alloc_name]
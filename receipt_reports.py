@@ -0,0 +1,152 @@
+"""
+CROSS-MONTH RECEIPT REPORTS
+===========================
+Monthly and financial-year totals per contractor, route and fault reason
+(BESCOM, road work, JJM pipeline, monkey bite...).
+
+Features:
+- One pass over the records: each record updates running totals
+  (count, sum, min, max), so memory depends on the number of distinct
+  contractors/routes/reasons, not on the number of rows
+- Reads any number of TY Adv Appl workbooks row by row (read-only), and/or
+  the issued vouchers in the voucher ledger
+- Written as CSV or as an Analytics sheet next to the receipts
+
+TY Adv Appl workbooks carry no contractor (contractors are assigned when
+receipts are generated), so per-contractor totals come from the ledger or
+from generated receipts.
+
+Usage:
+    python receipt_reports.py "Nov -25.xlsx" "Dec -25.xlsx" -o totals.csv
+    python receipt_reports.py --ledger data/voucher_ledger.db -o totals.xlsx
+"""
+
+import argparse
+import csv
+from datetime import datetime
+
+from ty_sheets import REASON_LABELS, fault_reason, iter_ty_entries, reason_from_description
+from voucher_ledger import financial_year
+
+GROUPS = ('contractor', 'route', 'reason', 'work_type')
+
+COLUMNS = ('Period Type', 'Period', 'Group', 'Name', 'Receipts', 'Total Amount',
+           'Smallest', 'Largest', 'Average')
+
+
+class ReceiptAggregates:
+    """Running totals per (month or financial year) x (contractor, route, reason, work type)"""
+
+    def __init__(self):
+        # {(period_type, period, group, name): [count, total, smallest, largest]}
+        self.totals = {}
+        self.records = 0
+
+    def add(self, date, amount, contractor=None, route=None, reason=None, work_type=None):
+        """Count one receipt. date is a datetime; missing names are left out of their group"""
+        names = {'contractor': contractor, 'route': route, 'reason': reason, 'work_type': work_type}
+        periods = (('Month', date.strftime('%Y-%m')), ('Year', financial_year(date)))
+        for period_type, period in periods:
+            for group in GROUPS:
+                name = names[group]
+                if not name:
+                    continue
+                key = (period_type, period, group, name)
+                total = self.totals.get(key)
+                if total is None:
+                    self.totals[key] = [1, amount, amount, amount]
+                else:
+                    total[0] += 1
+                    total[1] += amount
+                    if amount < total[2]:
+                        total[2] = amount
+                    if amount > total[3]:
+                        total[3] = amount
+        self.records += 1
+
+    def add_receipt(self, receipt):
+        """Count one generated receipt record (date as DD-MM-YYYY)"""
+        self.add(datetime.strptime(receipt['date'], '%d-%m-%Y'), receipt['amount'],
+                 contractor=receipt['contractor'].split(',')[0].strip(),
+                 route=receipt.get('route'), reason=receipt.get('reason'),
+                 work_type=receipt.get('work_type'))
+
+    def rows(self):
+        """Report rows: months then years, each group biggest total first"""
+        order = {'Month': 0, 'Year': 1}
+        keys = sorted(self.totals, key=lambda k: (order[k[0]], k[1], GROUPS.index(k[2]),
+                                                  -self.totals[k][1], k[3]))
+        for key in keys:
+            count, total, smallest, largest = self.totals[key]
+            yield key + (count, total, smallest, largest, round(total / count, 2))
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(self.rows())
+
+    def write_sheet(self, ws):
+        """Fill a worksheet with the report (bold heading row, frozen panes)"""
+        from openpyxl.styles import Font
+
+        ws.append(COLUMNS)
+        for cell in ws[1]:
+            cell.font = Font(bold=True)
+        for row in self.rows():
+            ws.append(row)
+        for col, width in zip('ABCDEFGHI', (12, 10, 12, 40, 10, 14, 10, 10, 10)):
+            ws.column_dimensions[col].width = width
+        ws.freeze_panes = 'A2'
+
+
+def aggregate_receipts(records):
+    """Totals for generated receipt records"""
+    aggregates = ReceiptAggregates()
+    for receipt in records:
+        aggregates.add_receipt(receipt)
+    return aggregates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monthly and yearly receipt totals per contractor, '
+                                                 'route and fault reason')
+    parser.add_argument('workbooks', nargs='*', help='TY Adv Appl workbooks (.xlsx)')
+    parser.add_argument('--ledger', help='voucher ledger database to include (do not also pass '
+                                         'the workbooks of months already in the ledger)')
+    parser.add_argument('-o', '--output', default='receipt_totals.csv',
+                        help='report file, .csv or .xlsx (default: receipt_totals.csv)')
+    args = parser.parse_args()
+    if not args.workbooks and not args.ledger:
+        parser.error('give TY Adv Appl workbooks and/or --ledger')
+
+    aggregates = ReceiptAggregates()
+    for path in args.workbooks:
+        for entry in iter_ty_entries(path):
+            is_pits = 'pit' in str(entry['pits_oh']).lower()
+            aggregates.add(entry['date'], entry['amount'], route=entry['route'],
+                           reason=REASON_LABELS[fault_reason(entry['work_details'], is_pits)],
+                           work_type="PITS Work" if is_pits else "OH Cable Work")
+
+    if args.ledger:
+        from voucher_ledger import VoucherLedger
+        for voucher in VoucherLedger(args.ledger).iter_vouchers():
+            aggregates.add(datetime.strptime(voucher['date'], '%Y-%m-%d'), voucher['amount'],
+                           contractor=voucher['contractor'].split(',')[0].strip(),
+                           route=voucher['route'],
+                           reason=REASON_LABELS[reason_from_description(voucher['description'])],
+                           work_type=voucher['work_type'])
+
+    if args.output.lower().endswith('.xlsx'):
+        import openpyxl
+        wb = openpyxl.Workbook()
+        wb.active.title = 'Analytics'
+        aggregates.write_sheet(wb.active)
+        wb.save(args.output)
+    else:
+        aggregates.write_csv(args.output)
+    print(f'{aggregates.records} receipts, {len(aggregates.totals)} totals written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
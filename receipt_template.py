@@ -0,0 +1,204 @@
+"""
+RECEIPT TEMPLATE WORKBOOKS
+==========================
+Fill an office's own receipt .xlsx template instead of drawing the vouchers.
+
+The first sheet of the template holds one voucher block. Cells may contain
+placeholders such as {date}, {voucher_no}, {amount} or "Received from
+{payer} Sum of Rupees {amount}/-". The block is read once: cell values,
+style IDs, merged ranges, row heights and column widths. A row without a
+height gets the one Excel would give its largest font, written out so the
+page breaks and the printed sheet agree. Each receipt then
+gets a copy of the block with its values filled in. Styles are copied by
+ID, so no Font/Alignment/Border objects are built per voucher and the
+output keeps the template's exact formatting.
+
+Placeholders:
+    voucher_no, date, contractor, route, work_type, description, amount,
+    amount_words, amount_words_title, payer, grant, budget_head
+
+A cell holding only {date}, {amount} or {voucher_no} gets a real date or
+number, so the template's number format applies.
+
+Usage:
+    template = load_template(open('official_voucher.xlsx', 'rb').read())
+    wb = template.new_workbook()
+    ws = wb.create_sheet('Cash Receipts')
+    next_row = template.write_block(ws, 1, receipt, office)
+
+    template = load_template_file(office.template)    # cached until the file changes
+"""
+
+import hashlib
+import io
+import os
+from copy import copy
+from datetime import datetime
+from string import Formatter
+
+from office_profiles import ResultCache
+
+FIELDS = ('voucher_no', 'date', 'contractor', 'route', 'work_type', 'description', 'amount',
+          'amount_words', 'amount_words_title', 'payer', 'grant', 'budget_head')
+
+# Fields written as typed values when they fill a whole cell
+TYPED_FIELDS = ('voucher_no', 'date', 'amount')
+
+# A voucher block bigger than this is not a voucher block
+MAX_TEMPLATE_ROWS = 60
+MAX_TEMPLATE_COLUMNS = 26
+
+# Excel's width for columns without one
+DEFAULT_COLUMN_WIDTH = 8.43
+DEFAULT_ROW_HEIGHT = 15
+DEFAULT_FONT_SIZE = 11
+
+# Parsed templates, keyed by the digest of the file
+_templates = ResultCache(8)
+
+# Templates read from disk: path -> (mtime_ns, size, parsed template)
+_template_files = ResultCache(8)
+
+
+def font_row_height(size):
+    """Height Excel/LibreOffice auto-size a row to for its largest font size (15pt for 11pt)"""
+    # About 4/3 of the font size, on Excel's 0.75pt grid; never below the default row
+    return max(DEFAULT_ROW_HEIGHT, round(size * 4 / 3 / 0.75) * 0.75)
+
+
+def template_fields(value):
+    """Placeholder names used in a cell value"""
+    return [name for _, name, _, _ in Formatter().parse(value) if name is not None]
+
+
+class VoucherTemplate:
+    """One voucher block read from a template workbook"""
+
+    def __init__(self, data):
+        import openpyxl
+        from openpyxl.cell.cell import MergedCell
+        from openpyxl.utils import get_column_letter
+
+        self.data = data
+        wb = openpyxl.load_workbook(io.BytesIO(data))
+        ws = wb.worksheets[0]
+        self.rows = ws.max_row
+        self.columns = ws.max_column
+        if self.rows > MAX_TEMPLATE_ROWS or self.columns > MAX_TEMPLATE_COLUMNS:
+            raise ValueError(f"Template voucher is {self.rows} rows x {self.columns} columns; "
+                             f"keep one voucher within {MAX_TEMPLATE_ROWS} x {MAX_TEMPLATE_COLUMNS} "
+                             f"on the first sheet")
+
+        # (row offset, column, style, kind, value) for every cell of the block;
+        # kind is None (fixed value), 'field' (typed value) or 'format' (text)
+        self.cells = []
+        # Largest font with text in each row, by row offset
+        font_sizes = {}
+        for row in ws.iter_rows(min_row=1, max_row=self.rows, max_col=self.columns):
+            for cell in row:
+                value = None if isinstance(cell, MergedCell) else cell.value
+                if value is not None:
+                    size = cell.font.sz or DEFAULT_FONT_SIZE
+                    font_sizes[cell.row - 1] = max(font_sizes.get(cell.row - 1, 0), size)
+                kind = None
+                if isinstance(value, str) and '{' in value:
+                    try:
+                        names = template_fields(value)
+                    except ValueError:
+                        raise ValueError(f"Unbalanced braces in template cell {cell.coordinate}")
+                    unknown = [name for name in names if name not in FIELDS]
+                    if unknown:
+                        raise ValueError(f"Unknown placeholder {{{unknown[0]}}} in template cell "
+                                         f"{cell.coordinate}")
+                    if value in {f'{{{name}}}' for name in TYPED_FIELDS}:
+                        kind, value = 'field', value[1:-1]
+                    else:
+                        kind = 'format'
+                if value is None and not cell.has_style:
+                    continue
+                self.cells.append((cell.row - 1, cell.column, copy(cell._style), kind, value))
+
+        self.merges = [(r.min_row - 1, r.min_col, r.max_row - 1, r.max_col) for r in ws.merged_cells.ranges]
+        self.row_heights = {row - 1: dim.height for row, dim in ws.row_dimensions.items()
+                            if dim.height is not None and row <= self.rows}
+        for row_offset, size in font_sizes.items():
+            if row_offset not in self.row_heights and font_row_height(size) > DEFAULT_ROW_HEIGHT:
+                self.row_heights[row_offset] = font_row_height(size)
+        self.column_widths = {}
+        for col in range(1, self.columns + 1):
+            letter = get_column_letter(col)
+            dim = ws.column_dimensions.get(letter)
+            self.column_widths[letter] = dim.width if dim is not None and dim.width else DEFAULT_COLUMN_WIDTH
+        self.last_column = get_column_letter(self.columns)
+        self.height = sum(self.row_heights.get(r, DEFAULT_ROW_HEIGHT) for r in range(self.rows))
+        wb.close()
+
+    def new_workbook(self):
+        """Empty workbook that carries the template's styles (and so its style IDs)"""
+        import openpyxl
+        wb = openpyxl.load_workbook(io.BytesIO(self.data))
+        for ws in list(wb.worksheets):
+            wb.remove(ws)
+        return wb
+
+    def write_block(self, ws, current_row, receipt, office):
+        """Copy the voucher block to current_row filled in for a receipt, return the next free row"""
+        from openpyxl.cell.cell import MergedCell
+        from openpyxl.worksheet.cell_range import CellRange
+        from openpyxl.worksheet.merge import MergedCellRange
+
+        values = dict(receipt)
+        values['date'] = datetime.strptime(receipt['date'], '%d-%m-%Y')
+        values['amount_words_title'] = receipt['amount_words'].title()
+        values['payer'] = office.payer
+        values['grant'] = office.grant
+        values['budget_head'] = office.budget_head(receipt['work_type'])
+        text_values = dict(values, date=receipt['date'])
+
+        # Merge first so the covered cells exist as merged cells and take their style below.
+        # The block is on fresh rows, so this skips ws.merge_cells(), which checks every
+        # existing range (quadratic over a big book) and rebuilds borders we overwrite anyway.
+        for min_row, min_col, max_row, max_col in self.merges:
+            merged = MergedCellRange(ws, CellRange(min_col=min_col, min_row=current_row + min_row,
+                                                   max_col=max_col, max_row=current_row + max_row).coord)
+            ws.merged_cells.ranges.add(merged)
+            for row, col in merged.cells:
+                if (row, col) != (merged.min_row, merged.min_col):
+                    ws._cells[row, col] = MergedCell(ws, row, col)
+
+        for row_offset, col, style, kind, value in self.cells:
+            cell = ws.cell(row=current_row + row_offset, column=col)
+            cell._style = copy(style)
+            if kind == 'field':
+                cell.value = values[value]
+            elif kind == 'format':
+                cell.value = value.format_map(text_values)
+            elif value is not None:
+                cell.value = value
+
+        for row_offset, height in self.row_heights.items():
+            ws.row_dimensions[current_row + row_offset].height = height
+
+        return current_row + self.rows
+
+
+def load_template(data):
+    """Parse template workbook bytes, reusing the parsed block for the same file"""
+    digest = hashlib.sha1(data).hexdigest()
+    template = _templates.get(digest)
+    if template is None:
+        template = VoucherTemplate(data)
+        _templates.put(digest, template)
+    return template
+
+
+def load_template_file(path):
+    """Parsed template of a workbook on disk, read again only when its mtime or size changes"""
+    stat = os.stat(path)
+    cached = _template_files.get(path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    with open(path, 'rb') as f:
+        template = load_template(f.read())
+    _template_files.put(path, (stat.st_mtime_ns, stat.st_size, template))
+    return template
@@ -0,0 +1,177 @@
+"""
+STATIC ASSET PIPELINE
+=====================
+Fingerprinted, long-cached URLs for the CSS and JS in static/.
+
+Features:
+- asset_url('style.css') gives /assets/<hash>/style.css, the hash changes
+  whenever the file does, so browsers can cache it for a year
+- Precompressed .gz (and .br when the brotli package is installed)
+  variants are built once and served to clients that accept them
+- Fingerprints are cached per file and only recomputed when it changes
+
+Usage:
+    python static_assets.py            build compressed variants ahead of deploy
+
+    In templates:
+    <link rel="stylesheet" href="{{ asset_url('style.css') }}">
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+
+try:
+    import brotli  # Optional, only used when installed
+except ImportError:
+    brotli = None
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# File types worth compressing
+COMPRESSIBLE = {'.css', '.js', '.svg', '.html', '.txt', '.json'}
+
+# Preferred first when the client accepts both
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# Length of the hash used in asset URLs
+FINGERPRINT_LENGTH = 12
+
+# Cache-Control for fingerprinted and plain URLs
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'
+
+# {filename: (mtime, size, fingerprint)}
+_fingerprints = {}
+_lock = threading.Lock()
+
+
+def asset_path(filename):
+    """Absolute path of a file inside static/, or None if it is outside"""
+    path = os.path.realpath(os.path.join(STATIC_FOLDER, filename))
+    if not path.startswith(os.path.realpath(STATIC_FOLDER) + os.sep):
+        return None
+    return path
+
+
+def fingerprint(filename):
+    """Short content hash of a static file (cached until the file changes)"""
+    path = asset_path(filename)
+    if path is None:
+        raise FileNotFoundError(filename)
+    stat = os.stat(path)
+    cached = _fingerprints.get(filename)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()[:FINGERPRINT_LENGTH]
+    with _lock:
+        _fingerprints[filename] = (stat.st_mtime_ns, stat.st_size, digest)
+    # New content, so make sure the compressed copies match it
+    try:
+        build_variants(filename)
+    except OSError:
+        pass  # Read-only static folder, the plain file is still served
+    return digest
+
+
+def build_variants(filename):
+    """Write .gz / .br copies of a static file when they are missing or stale"""
+    path = asset_path(filename)
+    if path is None or os.path.splitext(path)[1] not in COMPRESSIBLE:
+        return []
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    source_mtime = os.path.getmtime(path)
+
+    compressors = [('.gz', lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        compressors.append(('.br', lambda d: brotli.compress(d, quality=11)))
+
+    built = []
+    for suffix, compress in compressors:
+        target = path + suffix
+        if os.path.exists(target) and os.path.getmtime(target) >= source_mtime:
+            continue
+        # Write then rename so a request never reads a half-written file
+        tmp = f'{target}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(compress(data))
+        os.replace(tmp, target)
+        built.append(os.path.basename(target))
+    return built
+
+
+def build_all():
+    """Fingerprint every static file and build its compressed variants"""
+    built = {}
+    for root, _dirs, files in os.walk(STATIC_FOLDER):
+        for name in files:
+            if name.endswith(('.gz', '.br', '.tmp')):
+                continue
+            filename = os.path.relpath(os.path.join(root, name), STATIC_FOLDER).replace(os.sep, '/')
+            built[filename] = build_variants(filename)
+            fingerprint(filename)
+    return built
+
+
+def accepted_encodings(accept_encoding):
+    """{encoding: q} from an Accept-Encoding header (q defaults to 1)"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, *params = [item.strip() for item in part.split(';')]
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0  # Malformed, treat as not acceptable
+        accepted[name.lower()] = q
+    return accepted
+
+
+def pick_variant(filename, accept_encoding):
+    """Return (path, content_encoding) of the best variant the client accepts.
+
+    Encodings with q=0 are refused, also through '*'; among the rest the
+    highest q wins, then the order of ENCODINGS.
+    """
+    path = asset_path(filename)
+    accepted = accepted_encodings(accept_encoding)
+    candidates = []
+    for preference, (encoding, suffix) in enumerate(ENCODINGS):
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > 0 and os.path.exists(path + suffix):
+            candidates.append((-q, preference, path + suffix, encoding))
+    if candidates:
+        _, _, variant, encoding = min(candidates)
+        return variant, encoding
+    return path, None
+
+
+def register(app):
+    """Expose asset_url() to the app's templates"""
+
+    def asset_url(filename):
+        from flask import url_for
+        try:
+            digest = fingerprint(filename)
+        except OSError:
+            # Missing file: fall back to the plain static URL
+            return url_for('static', filename=filename)
+        return url_for('static_asset', digest=digest, filename=filename)
+
+    app.jinja_env.globals['asset_url'] = asset_url
+    return asset_url
+
+
+if __name__ == '__main__':
+    for name, variants in sorted(build_all().items()):
+        print(f"{name} [{fingerprint(name)}] {', '.join(variants) or 'up to date'}")
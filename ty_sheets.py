@@ -0,0 +1,202 @@
+"""
+TY ADV APPL SHEETS
+==================
+Reading the monthly TY Adv Appl workbooks and classifying their fault
+entries. Shared by the web app and the offline report scripts, so both
+read a sheet the same way without loading the Flask app.
+
+Features:
+- Finds the TY Adv Appl sheet and the claim period in its heading
+- Validates rows (date, route, work details, pits/OH, amount) and skips
+  headings, "Local Purchase" and "Total" lines
+- Reads cell values as Excel last calculated them, so an amount given as
+  a formula counts as its result everywhere
+- Fault reason of a cable cut (BESCOM, road work, JJM pipeline...) from
+  the work details, or back from a generated description
+
+Usage:
+    ty_data, rows_read, period = read_ty_data('Dec -25.xlsx')
+    for entry in iter_ty_entries('Dec -25.xlsx'):      # read-only, one row at a time
+        reason = REASON_LABELS[fault_reason(entry['work_details'], is_pits=True)]
+"""
+
+import re
+from datetime import datetime
+
+# Claim period in the TY Adv Appl heading
+PERIOD_PATTERN = re.compile(r'from\s+(\d{1,2}/\d{1,2}/\d{4})\s+up\s*to\s+(\d{1,2}/\d{1,2}/\d{4})', re.IGNORECASE)
+
+# Entry rows of the sheet: A date, B route, C work details, G pits/OH, H amount
+FIRST_ROW = 4
+LAST_ROW = 99
+COLUMNS = 8
+
+# Fault reasons: phrase used in the descriptions and label used in reports
+REASON_PHRASES_PITS = {
+    'pipeline': "due to JJM water pipeline trenching work",
+    'road': "due to road work",
+    'bescom': "due to BESCOM work",
+    'railway': "due to Railway work",
+    'fault': "for fault restoration",
+}
+
+REASON_PHRASES_OH_CABLE = {
+    'bescom': "due to BESCOM work",
+    'road': "due to road work",
+    'monkey': "due to Monkey bite",
+    'pipeline': "due to water pipeline work",
+    'fault': "for fault restoration",
+}
+
+REASON_LABELS = {
+    'pipeline': "Water pipeline (JJM)",
+    'road': "Road work",
+    'bescom': "BESCOM",
+    'railway': "Railway",
+    'monkey': "Monkey bite",
+    'fault': "Other fault",
+}
+
+
+def fault_reason(work_details, is_pits):
+    """Classify the cause of a cable cut from the TY Adv Appl work details"""
+    details = work_details.lower()
+    if is_pits:
+        if "water" in details or "pipeline" in details:
+            return 'pipeline'
+        if "road" in details or "nh" in details:
+            return 'road'
+        if "bescom" in details:
+            return 'bescom'
+        if "rly" in details or "railway" in details:
+            return 'railway'
+        return 'fault'
+
+    if "bescom" in details:
+        return 'bescom'
+    if "road" in details:
+        return 'road'
+    if "monkey" in details:
+        return 'monkey'
+    if "water" in details or "pipeline" in details:
+        return 'pipeline'
+    return 'fault'
+
+
+def reason_from_description(description):
+    """Recover the fault reason from a generated description (e.g. ledger rows)"""
+    for phrases in (REASON_PHRASES_PITS, REASON_PHRASES_OH_CABLE):
+        for reason, phrase in phrases.items():
+            if reason != 'fault' and phrase in description:
+                return reason
+    return 'fault'
+
+
+def parse_ty_row(date_val, route, work_details, pits_oh, amount):
+    """Validate one TY Adv Appl row, return its entry dict or None to skip it"""
+    if not date_val or not amount or work_details in ["Local Purchase", "Total", None]:
+        return None
+
+    if isinstance(date_val, datetime):
+        date_obj = date_val
+    else:
+        try:
+            date_obj = datetime.strptime(str(date_val), "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            try:
+                date_obj = datetime.strptime(str(date_val), "%Y-%m-%d")
+            except ValueError:
+                return None
+
+    return {
+        'date': date_obj,
+        'route': route if route else "",
+        'work_details': work_details if work_details else "",
+        'pits_oh': pits_oh if pits_oh else "",
+        'amount': int(amount) if amount else 0
+    }
+
+
+def read_sheet_period(ws_ty):
+    """Read the claim period from the sheet heading, e.g.
+    ' period from 01/11/2025 up to 30/11/2025 '. Returns (start, end) or None."""
+    for row_num in range(1, 4):
+        for col in range(1, 4):
+            value = ws_ty.cell(row_num, col).value
+            if not isinstance(value, str):
+                continue
+            match = PERIOD_PATTERN.search(value)
+            if match:
+                try:
+                    return (datetime.strptime(match.group(1), '%d/%m/%Y'),
+                            datetime.strptime(match.group(2), '%d/%m/%Y'))
+                except ValueError:
+                    return None
+    return None
+
+
+def find_ty_sheet(wb):
+    """Name of the TY Adv Appl sheet (or similar), else the first sheet"""
+    for name in wb.sheetnames:
+        if 'ty' in name.lower() and 'adv' in name.lower():
+            return name
+    return wb.sheetnames[0]
+
+
+def _ty_rows(ws_ty):
+    # (row number, (date, route, work details, pits/OH, amount)) for every entry row
+    for row_num, row in enumerate(ws_ty.iter_rows(min_row=FIRST_ROW, max_row=LAST_ROW, max_col=COLUMNS,
+                                                   values_only=True), FIRST_ROW):
+        row = tuple(row) + (None,) * (COLUMNS - len(row))
+        yield row_num, (row[0], row[1], row[2], row[6], row[7])
+
+
+def _open_workbook(input_file, read_only=False):
+    import openpyxl
+    # data_only: a formula cell gives the value Excel saved for it, not its formula
+    return openpyxl.load_workbook(input_file, read_only=read_only, data_only=True)
+
+
+def read_ty_data(input_file):
+    """Read TY Adv Appl entries from the uploaded Excel file.
+
+    Returns (ty_data, rows_read, period) where period is the (start, end)
+    claim period from the sheet heading, or None.
+    """
+    wb_source = _open_workbook(input_file)
+    try:
+        ws_ty = wb_source[find_ty_sheet(wb_source)]
+        period = read_sheet_period(ws_ty)
+
+        ty_data = []
+        rows_read = 0
+        for row_num, (date_val, route, work_details, pits_oh, amount) in _ty_rows(ws_ty):
+            if date_val or work_details or amount:
+                rows_read += 1
+
+            entry = parse_ty_row(date_val, route, work_details, pits_oh, amount)
+            if entry:
+                entry['row'] = row_num
+                ty_data.append(entry)
+    finally:
+        wb_source.close()
+
+    return ty_data, rows_read, period
+
+
+def iter_ty_entries(input_file):
+    """Yield TY Adv Appl entries one row at a time.
+
+    Opens the workbook read-only, so memory stays flat however many
+    workbooks are read (used by the cross-month reports).
+    """
+    wb_source = _open_workbook(input_file, read_only=True)
+    try:
+        ws_ty = wb_source[find_ty_sheet(wb_source)]
+        for row_num, values in _ty_rows(ws_ty):
+            entry = parse_ty_row(*values)
+            if entry:
+                entry['row'] = row_num
+                yield entry
+    finally:
+        wb_source.close()
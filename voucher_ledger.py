@@ -0,0 +1,310 @@
+"""
+VOUCHER LEDGER
+==============
+Local SQLite record of every cash receipt voucher that has been issued.
+
+Features:
+- Each job's receipts are inserted in one transaction, as pending until
+  the job's files exist (commit_job), or given back if it fails (void_job);
+  pending vouchers hold their numbers but are not counted as issued
+- Voucher numbers run on across jobs within a financial year
+  (April to March, e.g. "2025-26") instead of restarting at 1
+- Indexed lookup by date, contractor, route and amount for auditors
+- Entry fingerprints, so a fault already paid in an earlier job is spotted
+
+Usage:
+    ledger = VoucherLedger('data/voucher_ledger.db')
+    ledger.issue(records, job='Dec -25_cash_receipt_1a2b3c4d', source_file='Dec -25.xlsx', pending=True)
+    ledger.commit_job('Dec -25_cash_receipt_1a2b3c4d')    # or void_job() when the job fails
+    ledger.search(contractor='Tilak', date_from='2025-11-01')
+    ledger.jobs(date_from='2025-10-01', date_to='2025-12-31')
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vouchers (
+    id INTEGER PRIMARY KEY,
+    financial_year TEXT NOT NULL,
+    voucher_no INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    contractor TEXT NOT NULL COLLATE NOCASE,
+    route TEXT NOT NULL COLLATE NOCASE,
+    work_type TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    job TEXT NOT NULL,
+    source_file TEXT NOT NULL,
+    issued_at TEXT NOT NULL,
+    fingerprint TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'issued',
+    UNIQUE (financial_year, voucher_no)
+);
+CREATE INDEX IF NOT EXISTS idx_vouchers_date ON vouchers (date);
+CREATE INDEX IF NOT EXISTS idx_vouchers_contractor ON vouchers (contractor COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_vouchers_route ON vouchers (route COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_vouchers_amount ON vouchers (amount);
+CREATE INDEX IF NOT EXISTS idx_vouchers_job ON vouchers (job);
+"""
+
+# Columns added after the first release, created on older databases
+MIGRATIONS = {
+    'fingerprint': "ALTER TABLE vouchers ADD COLUMN fingerprint TEXT NOT NULL DEFAULT ''",
+    'status': "ALTER TABLE vouchers ADD COLUMN status TEXT NOT NULL DEFAULT 'issued'",
+}
+
+# Voucher status: numbered for a running job, or part of a finished book
+PENDING = 'pending'
+ISSUED = 'issued'
+
+POST_MIGRATION_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_vouchers_fingerprint ON vouchers (fingerprint);
+"""
+
+# SQLite's default limit on bound parameters per statement
+SQLITE_MAX_PARAMS = 900
+
+# Columns returned by search()
+COLUMNS = ('financial_year', 'voucher_no', 'date', 'contractor', 'route', 'work_type',
+           'amount', 'description', 'job', 'source_file', 'issued_at')
+
+MAX_SEARCH_RESULTS = 1000
+
+
+def financial_year(date_obj):
+    """Indian financial year (April-March) for a date, e.g. 2025-26"""
+    start = date_obj.year if date_obj.month >= 4 else date_obj.year - 1
+    return f'{start}-{str(start + 1)[-2:]}'
+
+
+class JobAlreadyIssued(Exception):
+    """Raised when vouchers were already recorded under a job name"""
+
+
+def _like_prefix(value):
+    # Escape LIKE wildcards so the prefix can still use the index
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+
+class VoucherLedger:
+    """SQLite-backed ledger of issued vouchers"""
+
+    def __init__(self, path):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            existing = {row['name'] for row in conn.execute('PRAGMA table_info(vouchers)')}
+            for column, statement in MIGRATIONS.items():
+                if column not in existing:
+                    conn.execute(statement)
+            conn.executescript(POST_MIGRATION_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # One short-lived connection per call keeps this safe across threads
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def issue(self, records, job, source_file, pending=False):
+        """Number the receipt records and store them in one transaction.
+
+        Each record's voucher_no is replaced with the next number of its
+        financial year. Records are changed in place and also returned.
+        With pending=True the vouchers only count as issued once
+        commit_job() is called. Raises JobAlreadyIssued if the job name
+        already has vouchers.
+        """
+        issued_at = datetime.now().isoformat(timespec='seconds')
+        status = PENDING if pending else ISSUED
+        conn = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front so two workers can
+            # never hand out the same number
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('SELECT 1 FROM vouchers WHERE job = ? LIMIT 1', (job,)).fetchone():
+                raise JobAlreadyIssued(f"Vouchers were already recorded for job {job}")
+            next_numbers = {}
+            rows = []
+            for record in records:
+                date_obj = datetime.strptime(record['date'], '%d-%m-%Y')
+                fy = financial_year(date_obj)
+                if fy not in next_numbers:
+                    last = conn.execute('SELECT MAX(voucher_no) FROM vouchers WHERE financial_year = ?',
+                                        (fy,)).fetchone()[0]
+                    next_numbers[fy] = (last or 0) + 1
+                record['voucher_no'] = next_numbers[fy]
+                record['financial_year'] = fy
+                next_numbers[fy] += 1
+                rows.append((fy, record['voucher_no'], date_obj.strftime('%Y-%m-%d'),
+                             record['contractor'], record['route'] or '', record['work_type'],
+                             record['amount'], record['description'], job, source_file, issued_at,
+                             record.get('fingerprint', ''), status))
+            conn.executemany(
+                'INSERT INTO vouchers (financial_year, voucher_no, date, contractor, route, work_type, '
+                'amount, description, job, source_file, issued_at, fingerprint, status) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return records
+
+    def commit_job(self, job):
+        """Mark a job's pending vouchers issued (its book exists), return how many"""
+        conn = self._connect()
+        try:
+            return conn.execute('UPDATE vouchers SET status = ? WHERE job = ? AND status = ?',
+                                (ISSUED, job, PENDING)).rowcount
+        finally:
+            conn.close()
+
+    def void_job(self, job):
+        """Drop a failed job's pending vouchers, return how many.
+
+        Their numbers are handed out again unless a later job already
+        took higher ones.
+        """
+        conn = self._connect()
+        try:
+            return conn.execute('DELETE FROM vouchers WHERE job = ? AND status = ?',
+                                (job, PENDING)).rowcount
+        finally:
+            conn.close()
+
+    def void_stale(self, older_than_seconds):
+        """Drop vouchers left pending by jobs whose worker died"""
+        cutoff = datetime.fromtimestamp(datetime.now().timestamp() - older_than_seconds)
+        conn = self._connect()
+        try:
+            return conn.execute('DELETE FROM vouchers WHERE status = ? AND issued_at < ?',
+                                (PENDING, cutoff.isoformat(timespec='seconds'))).rowcount
+        finally:
+            conn.close()
+
+    def job_vouchers(self, job):
+        """Issued vouchers of one job in the order they were numbered"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM vouchers WHERE job = ? AND status = ? "
+                                f"ORDER BY id", (job, ISSUED)).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def find_fingerprints(self, fingerprints):
+        """Look up entry fingerprints that were already issued.
+
+        Returns {fingerprint: "voucher <fy>/<no> (<source file>)"}.
+        """
+        found = {}
+        fingerprints = [fp for fp in fingerprints if fp]
+        conn = self._connect()
+        try:
+            for i in range(0, len(fingerprints), SQLITE_MAX_PARAMS):
+                chunk = fingerprints[i:i + SQLITE_MAX_PARAMS]
+                placeholders = ', '.join('?' * len(chunk))
+                rows = conn.execute(
+                    f'SELECT fingerprint, financial_year, voucher_no, source_file FROM vouchers '
+                    f'WHERE fingerprint IN ({placeholders}) AND status = ? ORDER BY id', chunk + [ISSUED])
+                for row in rows:
+                    found.setdefault(row['fingerprint'],
+                                     f"voucher {row['financial_year']}/{row['voucher_no']} ({row['source_file']})")
+        finally:
+            conn.close()
+        return found
+
+    def iter_vouchers(self):
+        """Yield every issued voucher in date order without loading them all"""
+        conn = self._connect()
+        try:
+            for row in conn.execute(f"SELECT {', '.join(COLUMNS)} FROM vouchers WHERE status = ? "
+                                    f"ORDER BY date, financial_year, voucher_no", (ISSUED,)):
+                yield dict(row)
+        finally:
+            conn.close()
+
+    def jobs(self, date_from=None, date_to=None, fy=None):
+        """Jobs with vouchers in a date range or financial year, oldest first.
+
+        Each is a dict of job, source_file, vouchers (in the range),
+        first_date and last_date.
+        """
+        clauses = ['status = ?']
+        params = [ISSUED]
+        if date_from:
+            clauses.append('date >= ?')
+            params.append(date_from)
+        if date_to:
+            clauses.append('date <= ?')
+            params.append(date_to)
+        if fy:
+            clauses.append('financial_year = ?')
+            params.append(fy)
+        where = f"WHERE {' AND '.join(clauses)}"
+        conn = self._connect()
+        try:
+            rows = conn.execute(f"SELECT job, MIN(source_file) AS source_file, COUNT(*) AS vouchers, "
+                                f"MIN(date) AS first_date, MAX(date) AS last_date FROM vouchers {where} "
+                                f"GROUP BY job ORDER BY first_date, job", params).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def search(self, date_from=None, date_to=None, contractor=None, route=None,
+               amount_min=None, amount_max=None, fy=None, voucher_no=None,
+               job=None, limit=100):
+        """Find issued vouchers. Dates are YYYY-MM-DD; contractor and route
+        match by (case-insensitive) prefix."""
+        clauses = ['status = ?']
+        params = [ISSUED]
+        if date_from:
+            clauses.append('date >= ?')
+            params.append(date_from)
+        if date_to:
+            clauses.append('date <= ?')
+            params.append(date_to)
+        if contractor:
+            clauses.append("contractor LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(contractor))
+        if route:
+            clauses.append("route LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(route))
+        if amount_min is not None:
+            clauses.append('amount >= ?')
+            params.append(amount_min)
+        if amount_max is not None:
+            clauses.append('amount <= ?')
+            params.append(amount_max)
+        if fy:
+            clauses.append('financial_year = ?')
+            params.append(fy)
+        if voucher_no is not None:
+            clauses.append('voucher_no = ?')
+            params.append(voucher_no)
+        if job:
+            clauses.append('job = ?')
+            params.append(job)
+
+        where = f"WHERE {' AND '.join(clauses)}"
+        limit = max(1, min(int(limit), MAX_SEARCH_RESULTS))
+        sql = (f"SELECT {', '.join(COLUMNS)} FROM vouchers {where} "
+               f"ORDER BY date, financial_year, voucher_no LIMIT ?")
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params + [limit]).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]